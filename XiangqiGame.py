@@ -2,6 +2,8 @@
 # Date: 3/3/2020
 # Description: Xiangqi. Chinese Chess.
 
+from xiangqi_tables import get_tables
+
 
 class XiangqiGame:
     def __init__(self):
@@ -74,6 +76,12 @@ class XiangqiGame:
                        ['--', '--', '--', '--', '--', '--', '--', '--', '--'],
                        [self._rR1, self._rH1, self._rE1, self._rA1, self._rG, self._rA2, self._rE2, self._rH2, self._rR2]]
 
+        # Counts of the pieces of each color attacking each square, kept up to
+        # date as pieces move so check can be looked up instead of searched
+        # for. None until it is first needed, and after trusted moves were
+        # played without it, see _get_attack_map.
+        self._attack_map = None
+
         # Game initialized to unfinished. Will be updated as the game goes.
         # Can be 'RED_WON' or 'BLACK_WON'
         self._game_state = "UNFINISHED"
@@ -83,6 +91,17 @@ class XiangqiGame:
         # Red and Black initialized to not in check
         self._rCheck = False
         self._bCheck = False
+        # True when the position changed without the check status and game
+        # state being worked out, which is then left until they are asked for
+        self._status_stale = False
+
+        # What the last make_move changed, for sending to spectators instead
+        # of the whole board. None until a move is made, or after the position
+        # changes some other way.
+        self._last_change = None
+        # Counts every change to the position, one per move and one per
+        # set_fen, so a spectator can tell when it has missed one
+        self._change_number = 0
 
         # Used for converting between Xiangqi coordinates and array indexing
         self._column_pairs = {
@@ -143,29 +162,65 @@ class XiangqiGame:
         column_index = self._column_pairs[coord[0]]
         return self._board[row_index][column_index]
 
+    def get_coord_from_index(self, row_index, column_index):
+        """Given row and column indexes of the board array, returns the
+        respective Xiangqi coordinate string"""
+        return 'abcdefghi'[column_index] + str(10 - row_index)
+
     def get_game_state(self):
         """Returns the state of the game. UNFINISHED, 'RED_WON', 'BLACK_WON'"""
+        if self._status_stale:
+            self.update_status()
         return self._game_state
 
+    def get_change_number(self):
+        """Returns the number of changes made to the position so far: one
+        for each move played and one for each set_fen"""
+        return self._change_number
+
+    def get_last_change(self):
+        """Returns what the last move changed as a tuple of (piece, source,
+        destination, captured piece or None, red in check, black in check,
+        game state, change number after the move), with pieces as names such
+        as 'rH'. Returns None if no
+        move has been made since the position was set up, if the last
+        make_move was rejected, or if apply_moves played more than one move,
+        as one change can't describe them."""
+        return self._last_change
+
     def is_in_check(self, color):
         """Given color as a string, returns whether the color is in check"""
+        if self._status_stale:
+            self.update_status()
         if color == 'red':
             return self._rCheck
         elif color == 'black':
             return self._bCheck
 
-    def make_move(self, source, destination):
+    def make_move(self, source, destination=None):
         """Given a source and destination coordinate as strings, moves piece
-        from source to destination"""
+        from source to destination. A Move or a move string such as 'h3e3' can
+        be given as the source instead, with no destination."""
+
+        # A change left from an earlier move must not be mistaken for this
+        # one's if this move is rejected
+        self._last_change = None
 
         # If the game is over
-        if self._game_state != "UNFINISHED":
+        if self.get_game_state() != "UNFINISHED":
             return False
 
-        # This is the object at the source coordinate's index
-        source_item = self.get_object_from_coord(source)
-        source_index = self.get_index_from_coord(source)
-        dest_index = self.get_index_from_coord(destination)
+        # The coordinates are only parsed into board squares once
+        if destination is None:
+            move = Move.parse(source)
+        else:
+            move = Move(source, destination)
+        source = move.source
+        destination = move.destination
+
+        # This is the object at the source square
+        source_item = self._board[move.source_square // 9][
+            move.source_square % 9]
 
         # If the source is empty, or it isn't the source's turn, return False
         if source_item == '--' or source_item.get_color() != self._turn:
@@ -176,150 +231,73 @@ class XiangqiGame:
         # general are included in the list.
         legal_destinations = self.legality_check(source_item)
 
-        # A copy of the legal destinations list is made for iteration
-        copy_legal_destinations = legal_destinations.copy()
-        # Iterate through the legal destinations list to remove pieces that
-        # cause self check. This is done by performing the move, checking for
-        # check, and then resetting the board.
-        for coord in copy_legal_destinations:
-            coord_index = self.get_index_from_coord(coord)
-            coord_item = self.get_object_from_coord(coord)
-
-            # Move the piece from the source to the destination testing for self
-            # check
-
-            # Update the piece's coordinate, update board by moving piece to
-            # destination and by clearing the source coordinates spot on the
-            # board.
-            source_item.update_coordinate(coord)
-            self._board[coord_index[0]][coord_index[1]] = source_item
-            self._board[source_index[0]][source_index[1]] = '--'
-
-            # Check if that move causes self check, if so remove it as a legal
-            # destination
-            if self.check_for_check() is True:
-                legal_destinations.remove(coord)
-
-            # Reset the board
-            self._board[source_index[0]][source_index[1]] = source_item
-            self._board[coord_index[0]][coord_index[1]] = coord_item
-            source_item.update_coordinate(source)
-
-        # If the given destination is not in the list of legal destinations
+        # If the given destination is not in the list, there is no need to test
+        # the destinations for self check
         if destination not in legal_destinations:
             return False
 
-        # Make the move, update player's check status, pass turn to next player,
-        # update player's check status, check if current player has any legal
-        # moves left, update game state, return True
-        else:
-            # Make the move
-            source_item.update_coordinate(destination)
-            self._board[dest_index[0]][dest_index[1]] = source_item
-            self._board[source_index[0]][source_index[1]] = '--'
-
-            # Update current player's check status
-            currently_in_check = self.check_for_check()
-            if currently_in_check:
-                if self._turn == 'r':
-                    self._rCheck = True
-                elif self._turn == 'b':
-                    self._bCheck = True
-            elif currently_in_check is False:
-                if self._turn == 'r':
-                    self._rCheck = False
-                elif self._turn == 'b':
-                    self._bCheck = False
-
-            # Change the turn the the next player
-            self.change_turn()
+        # Test the move for self check by performing the move, checking for
+        # check, and then resetting the board.
+        captured = self._move_squares(move.source_square,
+                                      move.destination_square, destination)
+        if self.check_for_check() is True:
+            self._unmove_squares(move.source_square, move.destination_square,
+                                 source, captured)
+            return False
 
-            # Update the current player's check status
-            current_in_check = self.check_for_check()
-            if current_in_check:
-                if self._turn == 'r':
-                    self._rCheck = True
-                elif self._turn == 'b':
-                    self._bCheck = True
-            elif current_in_check is False:
-                if self._turn == 'r':
-                    self._rCheck = False
-                elif self._turn == 'b':
-                    self._bCheck = False
-
-            # There are no legal moves for the current player until one if found
-            no_legal_moves = True
-
-            # Loop through all of the pieces in the board
-            for row in self._board:
-                for item in row:
-                    if item != '--':
-                        # If it's b's turn, only check legal moves for black
-                        if self._turn == 'b' and item.get_color() == 'b':
-                            l_d = self.legality_check(item)
-
-                            # Iterate through the legal destinations list to
-                            # remove pieces that cause self check. This is done
-                            # by performing the move, checking for check, and
-                            # then resetting the board.
-                            copy_l_d = l_d.copy()
-                            for destination in copy_l_d:
-                                destination_index = self.get_index_from_coord(destination)
-                                destination_item = self.get_object_from_coord(destination)
-                                item_coord = item.get_coordinate()
-                                item_index = self.get_index_from_coord(item_coord)
-
-                                item.update_coordinate(destination)
-                                self._board[destination_index[0]][destination_index[1]] = item
-                                self._board[item_index[0]][item_index[1]] = '--'
-
-                                if self.check_for_check() is True:
-                                    l_d.remove(destination)
-
-                                self._board[item_index[0]][item_index[1]] = item
-                                self._board[destination_index[0]][destination_index[1]] = destination_item
-                                item.update_coordinate(item_coord)
-                            # If any legal moves are found for this black piece,
-                            # there are legal moves
-                            if len(l_d) > 0:
-                                no_legal_moves = False
-                        # Same as above but for red pieces
-                        elif self._turn == 'r' and item.get_color() == 'r':
-                            l_d = self.legality_check(item)
-                            copy_l_d = l_d.copy()
-                            for destination in copy_l_d:
-                                destination_index = self.get_index_from_coord(
-                                    destination)
-                                destination_item = self.get_object_from_coord(
-                                    destination)
-                                item_coord = item.get_coordinate()
-                                item_index = self.get_index_from_coord(
-                                    item_coord)
-
-                                item.update_coordinate(destination)
-                                self._board[destination_index[0]][
-                                    destination_index[1]] = item
-                                self._board[item_index[0]][item_index[1]] = '--'
-
-                                if self.check_for_check() is True:
-                                    l_d.remove(destination)
-
-                                self._board[item_index[0]][item_index[1]] = item
-                                self._board[destination_index[0]][
-                                    destination_index[1]] = destination_item
-                                item.update_coordinate(item_coord)
-
-                            if len(l_d) > 0:
-                                no_legal_moves = False
-
-            # If there are no legal moves for the current player, update the
-            # game state
-            if no_legal_moves and self._turn == 'b':
+        # The move stays made. Update player's check status, pass turn to next
+        # player, update player's check status, check if current player has any
+        # legal moves left, update game state, return True
+
+        # Update current player's check status. A legal move never leaves its
+        # own player in check.
+        if self._turn == 'r':
+            self._rCheck = False
+        elif self._turn == 'b':
+            self._bCheck = False
+
+        # Change the turn the the next player
+        self.change_turn()
+
+        # Update the current player's check status
+        current_in_check = self.check_for_check()
+        if self._turn == 'r':
+            self._rCheck = current_in_check
+        elif self._turn == 'b':
+            self._bCheck = current_in_check
+
+        # If there are no legal moves for the current player, update the
+        # game state
+        if not self.has_legal_moves():
+            if self._turn == 'b':
                 self._game_state = 'RED_WON'
-            elif no_legal_moves and self._turn == 'r':
+            elif self._turn == 'r':
                 self._game_state = 'BLACK_WON'
+
+        self._change_number += 1
+        self._last_change = (source_item.print_piece(), source, destination,
+                             None if captured == '--'
+                             else captured.print_piece(),
+                             self._rCheck, self._bCheck, self._game_state,
+                             self._change_number)
         return True
 
+    def analyze(self, multipv=1, time_ms=None, nodes=None, depth=None,
+                stop_event=None, callback=None):
+        """Returns the multipv best moves for the player to move as a list of
+        (move, score, principal variation), best first, with moves as
+        (source, destination) pairs and scores from the mover's point of view.
+        The search deepens until time_ms milliseconds or nodes nodes are used
+        up, or stop_event is set, and callback is given the depth and lines
+        after each finished depth. A tight limit can end the first depth
+        before every line is searched, and then fewer lines are returned,
+        but never none. Analysis of the same game reuses one transposition
+        table and is safe to run from several threads."""
+        # Imported here so the search isn't loaded with the game
+        from xiangqi_search import analyze
+        return analyze(self, multipv, time_ms, nodes, depth, stop_event,
+                       callback)
+
     def print_board(self):
         """Prints the board by iterating through it"""
         print('==========================')
@@ -332,6 +310,135 @@ class XiangqiGame:
             print()
         print('==========================')
 
+    def get_fen(self):
+        """Returns the position as a FEN string. Ranks are listed from 10 down
+        to 1, red pieces are upper case and black lower case using the letters
+        K, A, B, N, R, C and P, followed by the player to move."""
+        fen_letters = {'G': 'k', 'A': 'a', 'E': 'b', 'H': 'n', 'R': 'r',
+                       'C': 'c', 'S': 'p'}
+        ranks = []
+        for row in self._board:
+            rank = ''
+            empty = 0
+            for item in row:
+                if item == '--':
+                    empty += 1
+                    continue
+                if empty > 0:
+                    rank += str(empty)
+                    empty = 0
+                letter = fen_letters[item.print_piece()[1]]
+                if item.get_color() == 'r':
+                    letter = letter.upper()
+                rank += letter
+            if empty > 0:
+                rank += str(empty)
+            ranks.append(rank)
+        return '/'.join(ranks) + (' w' if self._turn == 'r' else ' b')
+
+    def set_fen(self, fen):
+        """Sets up the position from a FEN string as written by get_fen. The
+        letters E and H are accepted for elephants and horses, and r for red
+        to move. Check status and game state are worked out for the new
+        position when they are first asked for. Raises ValueError for a malformed FEN or a position without
+        both generals."""
+        piece_classes = {
+            'K': redGeneral, 'A': redAdvisor, 'B': redElephant,
+            'E': redElephant, 'N': redHorse, 'H': redHorse, 'R': redRook,
+            'C': redCannon, 'P': redSoldier,
+            'k': blackGeneral, 'a': blackAdvisor, 'b': blackElephant,
+            'e': blackElephant, 'n': blackHorse, 'h': blackHorse,
+            'r': blackRook, 'c': blackCannon, 'p': blackSoldier
+        }
+        fields = fen.split()
+        ranks = fields[0].split('/') if fields else []
+        if len(ranks) != 10:
+            raise ValueError('FEN must have 10 ranks: ' + fen)
+
+        board = []
+        red_general = None
+        black_general = None
+        for row_index, rank in enumerate(ranks):
+            row = []
+            for letter in rank:
+                if letter.isdigit():
+                    row.extend(['--'] * int(letter))
+                elif letter in piece_classes:
+                    coord = self.get_coord_from_index(row_index, len(row))
+                    if letter == 'K':
+                        piece = redGeneral()
+                        red_general = piece
+                    elif letter == 'k':
+                        piece = blackGeneral()
+                        black_general = piece
+                    else:
+                        piece = piece_classes[letter](coord)
+                    piece.update_coordinate(coord)
+                    row.append(piece)
+                else:
+                    raise ValueError('Unknown FEN piece ' + letter)
+                if len(row) > 9:
+                    raise ValueError('FEN rank is too long: ' + rank)
+            if len(row) != 9:
+                raise ValueError('FEN rank is too short: ' + rank)
+            board.append(row)
+        if red_general is None or black_general is None:
+            raise ValueError('FEN needs both generals: ' + fen)
+
+        # Only the generals are looked up by attribute, the other named pieces
+        # from the starting position no longer apply
+        self._board = board
+        self._attack_map = None
+        self._rG = red_general
+        self._bG = black_general
+        if len(fields) > 1 and fields[1] == 'b':
+            self._turn = 'b'
+        else:
+            self._turn = 'r'
+
+        self._last_change = None
+        self._change_number += 1
+        self._status_stale = True
+
+    def update_status(self):
+        """Works out both players' check status and the game state from the
+        board, for when the position was set up without make_move"""
+        self._status_stale = False
+        # Check status for both players, then whether the player to move has
+        # any way out
+        self.change_turn()
+        opponent_in_check = self.check_for_check()
+        self.change_turn()
+        current_in_check = self.check_for_check()
+        if self._turn == 'r':
+            self._rCheck = current_in_check
+            self._bCheck = opponent_in_check
+        else:
+            self._rCheck = opponent_in_check
+            self._bCheck = current_in_check
+
+        self._game_state = "UNFINISHED"
+        if not self.has_legal_moves():
+            if self._turn == 'b':
+                self._game_state = 'RED_WON'
+            else:
+                self._game_state = 'BLACK_WON'
+
+    def has_legal_moves(self):
+        """Returns True if the player to move has at least one move that
+        doesn't leave them in check"""
+        for row in self._board:
+            for item in row:
+                if item != '--' and item.get_color() == self._turn:
+                    source = item.get_coordinate()
+                    for destination in self.legality_check(item):
+                        captured = self.move_piece(source, destination)
+                        in_check = self.check_for_check()
+                        self.unmove_piece(source, destination, captured)
+                        if not in_check:
+                            return True
+        return False
+
     def check_for_check(self):
         """Checks if the current player is in check. Used for removing
         illegal moves. Returns True if in check, False otherwise"""
@@ -339,24 +446,52 @@ class XiangqiGame:
         flying_general = self.is_flying_general()
         if flying_general:
             return True
-        # If it's red's turn, loop through the board and check black legal moves
-        # to see if any of them contain's red general's coordinate
+        # If it's red's turn, look up whether any black piece attacks the red
+        # general's square in the attack map, and the other way around
+        if self._turn == 'r':
+            row, column = self.get_index_from_coord(self._rG.get_coordinate())
+            return self._get_attack_map().get_count(row * 9 + column,
+                                                    'b') > 0
+        else:
+            row, column = self.get_index_from_coord(self._bG.get_coordinate())
+            return self._get_attack_map().get_count(row * 9 + column,
+                                                    'r') > 0
+
+    def get_attack_count(self, coord, color):
+        """Given a coordinate string and color as a string ('red' or 'black'),
+        returns how many pieces of that color attack the coordinate. Pieces
+        defending their own color's pieces count as attacking them."""
+        row, column = self.get_index_from_coord(coord)
+        return self._get_attack_map().get_count(row * 9 + column, color[0])
+
+    def is_square_attacked(self, coord, color):
+        """Given a coordinate string and color as a string, returns whether
+        any piece of that color attacks the coordinate. For a coordinate
+        holding a piece of the same color this says whether it is defended."""
+        return self.get_attack_count(coord, color) > 0
+
+    def get_threatened_pieces(self, color):
+        """Given color as a string, returns the coordinates of that color's
+        pieces that are attacked by the other color"""
+        enemy = 'b' if color == 'red' else 'r'
+        attack_map = self._get_attack_map()
+        threatened = []
         for row in self._board:
             for item in row:
-                if item != '--':
-                    if self._turn == 'r':
-                        if item.get_color() == 'b':
-                            legal_dest = self.legality_check(item)
-                            for legal_d in legal_dest:
-                                if legal_d == self._rG.get_coordinate():
-                                    return True
-                    elif self._turn == 'b':
-                        if item.get_color() == 'r':
-                            legal_dest = self.legality_check(item)
-                            for legal_d in legal_dest:
-                                if legal_d == self._bG.get_coordinate():
-                                    return True
-        return False
+                if item != '--' and item.get_color() == color[0]:
+                    row_index, column_index = self.get_index_from_coord(
+                        item.get_coordinate())
+                    if attack_map.get_count(
+                            row_index * 9 + column_index, enemy) > 0:
+                        threatened.append(item.get_coordinate())
+        return threatened
+
+    def _get_attack_map(self):
+        """Returns the attack map, building it from the board if there isn't
+        one yet"""
+        if self._attack_map is None:
+            self._attack_map = AttackMap(self._board)
+        return self._attack_map
 
     def is_flying_general(self):
         """Returns True if the space between the generals is empty, False if
@@ -863,6 +998,145 @@ class XiangqiGame:
 
         return legal_coords
 
+    def capture_check(self, piece):
+        """Takes a piece, returns a list of the destinations where it captures
+        an enemy piece, including illegal self check captures. Rooks and
+        cannons only look for the pieces along their lines so that captures can
+        be generated without building every quiet destination."""
+        piece_coord = piece.get_coordinate()
+        piece_type = piece.print_piece()[1]
+        capture_coords = []
+
+        if piece_type == 'R' or piece_type == 'C':
+            row, column = self.get_index_from_coord(piece_coord)
+            # Right, left, up, down as row and column steps
+            for row_step, column_step in ((0, 1), (0, -1), (-1, 0), (1, 0)):
+                r = row + row_step
+                c = column + column_step
+                # Rooks capture the first piece found, cannons need to jump
+                # exactly one piece first
+                screens = 0 if piece_type == 'R' else 1
+                while 0 <= r < 10 and 0 <= c < 9:
+                    item = self._board[r][c]
+                    if item != '--':
+                        if screens == 0:
+                            if item.get_color() != piece.get_color():
+                                capture_coords.append(
+                                    self.get_coord_from_index(r, c))
+                            break
+                        screens -= 1
+                    r += row_step
+                    c += column_step
+        else:
+            # Every other piece has at most a handful of destinations, so the
+            # regular legality check is filtered for occupied squares
+            for coord in self.legality_check(piece):
+                if self.get_object_from_coord(coord) != '--':
+                    capture_coords.append(coord)
+
+        return capture_coords
+
+    def move_piece(self, source, destination):
+        """Moves the piece at source to destination without any legality
+        checks or turn changes. Returns whatever was at the destination so the
+        move can be taken back with unmove_piece."""
+        source_index = self.get_index_from_coord(source)
+        dest_index = self.get_index_from_coord(destination)
+        return self._move_squares(source_index[0] * 9 + source_index[1],
+                                  dest_index[0] * 9 + dest_index[1],
+                                  destination)
+
+    def unmove_piece(self, source, destination, captured):
+        """Takes back a move made with move_piece, putting the captured item
+        back on the destination"""
+        source_index = self.get_index_from_coord(source)
+        dest_index = self.get_index_from_coord(destination)
+        self._unmove_squares(source_index[0] * 9 + source_index[1],
+                             dest_index[0] * 9 + dest_index[1], source,
+                             captured)
+
+    def _move_squares(self, source_square, dest_square, destination):
+        """move_piece for squares numbered 0-89 that are already known. The
+        destination coordinate string is given for the piece to keep."""
+        source_row, source_column = divmod(source_square, 9)
+        dest_row, dest_column = divmod(dest_square, 9)
+        source_item = self._board[source_row][source_column]
+        captured = self._board[dest_row][dest_column]
+
+        source_item.update_coordinate(destination)
+        self._board[dest_row][dest_column] = source_item
+        self._board[source_row][source_column] = '--'
+        if self._attack_map is not None:
+            self._attack_map.move(source_square, dest_square, captured)
+        return captured
+
+    def _unmove_squares(self, source_square, dest_square, source, captured):
+        """unmove_piece for squares numbered 0-89 that are already known"""
+        source_row, source_column = divmod(source_square, 9)
+        dest_row, dest_column = divmod(dest_square, 9)
+        moved_item = self._board[dest_row][dest_column]
+
+        moved_item.update_coordinate(source)
+        self._board[source_row][source_column] = moved_item
+        self._board[dest_row][dest_column] = captured
+        if self._attack_map is not None:
+            self._attack_map.unmove(source_square, dest_square, captured)
+
+    def apply_moves(self, moves, validate=True):
+        """Plays a sequence of moves, each a Move, a pair of coordinate
+        strings or a move string such as 'h3e3'. Returns True if every move
+        was played. With validate, each move goes through make_move and the
+        sequence stops at the first illegal one, leaving the moves before it
+        played. Without validate the moves are trusted, e.g. when restoring a
+        stored game: they are played straight onto the board without keeping
+        the attack map up to date, and the attack map, check status and game
+        state are only worked out when they are next needed."""
+        if validate:
+            played = 0
+            for move in moves:
+                if not isinstance(move, Move):
+                    move = Move.parse(move)
+                if not self.make_move(move):
+                    return False
+                played += 1
+            if played > 1:
+                self._last_change = None
+            return True
+
+        # A finished game is only looked for when its state is known, as
+        # working it out here would cost the scan trusted moves skip
+        if not self._status_stale and self._game_state != "UNFINISHED":
+            return False
+        self._attack_map = None
+        for move in moves:
+            if not isinstance(move, Move):
+                move = Move.parse(move)
+            self._move_squares(move.source_square, move.destination_square,
+                               move.destination)
+            self.change_turn()
+            self._change_number += 1
+        self._last_change = None
+        self._status_stale = True
+        return True
+
+    def apply_change(self, change):
+        """Plays the move in a change from another game's get_last_change,
+        e.g. to mirror a game being watched. The move is trusted and the
+        check status and game state are taken from the change rather than
+        worked out again. The change counts as one change to this game, see
+        get_change_number."""
+        source = change[1]
+        destination = change[2]
+        self._move_squares(Move.square_from_coord(source),
+                           Move.square_from_coord(destination), destination)
+        self.change_turn()
+        self._rCheck = change[4]
+        self._bCheck = change[5]
+        self._game_state = change[6]
+        self._status_stale = False
+        self._change_number += 1
+        self._last_change = change[:7] + (self._change_number,)
+
     def print_all_legal_destinations(self):
         """This is used for testing only. It returns all the legal moves for
         the current player before and after removing self check moves"""
@@ -876,27 +1150,16 @@ class XiangqiGame:
                         l_d = self.legality_check(item)
                         print(item.print_piece(), 'before:', l_d)
                         copy_l_d = l_d.copy()
+                        item_coord = item.get_coordinate()
                         for destination in copy_l_d:
-                            destination_index = self.get_index_from_coord(
-                                destination)
-                            destination_item = self.get_object_from_coord(
-                                destination)
-                            item_coord = item.get_coordinate()
-                            item_index = self.get_index_from_coord(item_coord)
-
-                            item.update_coordinate(destination)
-                            self._board[destination_index[0]][
-                                destination_index[1]] = item
-                            self._board[item_index[0]][item_index[1]] = '--'
+                            captured = self.move_piece(item_coord, destination)
 
                             is_check = self.check_for_check()
                             if is_check is True:
                                 l_d.remove(destination)
 
-                            self._board[item_index[0]][item_index[1]] = item
-                            self._board[destination_index[0]][
-                                destination_index[1]] = destination_item
-                            item.update_coordinate(item_coord)
+                            self.unmove_piece(item_coord, destination,
+                                              captured)
 
                         print(item.print_piece(), ' after:', l_d)
                         print('-----------------------------------------------')
@@ -918,6 +1181,252 @@ class XiangqiGame:
                         print(item.get_coordinate())
 
 
+class Move:
+    """
+    A move from one coordinate to another, parsed once into board squares
+    numbered 0-89 in board array order. Can be passed to make_move and
+    apply_moves, and unpacks into (source, destination) coordinate strings.
+    """
+    __slots__ = ('source', 'destination', 'source_square',
+                 'destination_square')
+
+    # Rank numbers in this game's coordinates and in ICCS
+    _RANKS = frozenset(str(rank) for rank in range(1, 11))
+    _ICCS_RANKS = frozenset(str(rank) for rank in range(10))
+
+    def __init__(self, source, destination):
+        """Initializes the move from source and destination coordinate
+        strings such as 'h3' and 'e3'. Raises ValueError for coordinates that
+        aren't on the board."""
+        self.source = source
+        self.destination = destination
+        self.source_square = Move.square_from_coord(source)
+        self.destination_square = Move.square_from_coord(destination)
+
+    @staticmethod
+    def square_from_coord(coord):
+        """Returns the board square 0-89 for a coordinate string"""
+        if (len(coord) < 2 or not 'a' <= coord[0] <= 'i' or
+                not coord[1:].isdigit() or not 1 <= int(coord[1:]) <= 10):
+            raise ValueError('Not a board coordinate: ' + str(coord))
+        return (10 - int(coord[1:])) * 9 + ord(coord[0]) - ord('a')
+
+    @staticmethod
+    def parse(move):
+        """Returns the Move for a move string in this game's coordinates such
+        as 'h3e3' or 'h3-e3', or for a pair of coordinate strings"""
+        if isinstance(move, Move):
+            return move
+        if not isinstance(move, str):
+            return Move(move[0], move[1])
+        coords = Move._split(move, Move._RANKS)
+        if coords is None:
+            raise ValueError('Not a move: ' + move)
+        return Move(*coords)
+
+    @staticmethod
+    def from_iccs(text):
+        """Returns the Move for an ICCS move such as 'h2e2' or 'H2-E2'. ICCS
+        numbers the ranks 0-9 from red's side, one below this game's ranks."""
+        coords = Move._split(text, Move._ICCS_RANKS)
+        if coords is None:
+            raise ValueError('Not an ICCS move: ' + text)
+        return Move(*(coord[0] + str(int(coord[1:]) + 1) for coord in coords))
+
+    @staticmethod
+    def _split(text, ranks):
+        """Returns the two coordinates of a move string such as 'h3e3' or
+        'h3-e3', each a column a-i followed by one of ranks, or None if it
+        isn't one. Plain string checks, so importing the module doesn't pull
+        in re."""
+        text = text.strip().lower()
+        for index in range(2, len(text)):
+            if 'a' <= text[index] <= 'i':
+                break
+        else:
+            return None
+        coords = (text[:index - 1] if text[index - 1] == '-'
+                  else text[:index], text[index:])
+        for coord in coords:
+            if (len(coord) < 2 or not 'a' <= coord[0] <= 'i' or
+                    coord[1:] not in ranks):
+                return None
+        return coords
+
+    def to_iccs(self):
+        """Returns the move in ICCS notation, e.g. h2e2"""
+        return (self.source[0] + str(int(self.source[1:]) - 1) +
+                self.destination[0] + str(int(self.destination[1:]) - 1))
+
+    def __iter__(self):
+        """Unpacks into the source and destination coordinate strings"""
+        return iter((self.source, self.destination))
+
+    def __eq__(self, other):
+        """Moves are equal when they have the same squares"""
+        if not isinstance(other, Move):
+            return NotImplemented
+        return (self.source_square == other.source_square and
+                self.destination_square == other.destination_square)
+
+    def __hash__(self):
+        """Hashes the move by its squares"""
+        return self.source_square * 90 + self.destination_square
+
+    def __repr__(self):
+        """Returns the move as text, e.g. h3e3"""
+        return self.source + self.destination
+
+
+class AttackMap:
+    """
+    For each color, the number of pieces attacking each square of a board,
+    with squares numbered 0-89 in board array order. A piece attacks the
+    squares it could capture on, whichever color is there. Every piece also
+    has the squares its attacks depend on: the squares along a rook's or
+    cannon's lines up to where it stops, a horse's legs and an elephant's
+    eyes. When a piece moves, only the pieces depending on the two squares
+    that changed are recomputed.
+    """
+
+    def __init__(self, board):
+        """Builds the map for every piece on the board array. The board is
+        kept and must be updated before calling move or unmove."""
+        self._board = board
+        self._tables = get_tables()
+        self._counts = {'r': [0] * 90, 'b': [0] * 90}
+        self._attacks = {}
+        self._depends = {}
+        self._squares = {}
+        self._watchers = [set() for _ in range(90)]
+        for row_index, row in enumerate(board):
+            for column_index, item in enumerate(row):
+                if item != '--':
+                    self._add(item, row_index * 9 + column_index)
+
+    def get_count(self, square, color):
+        """Returns how many pieces of color ('r' or 'b') attack the square"""
+        return self._counts[color][square]
+
+    def get_attacks(self, piece):
+        """Returns the squares attacked by a piece on the board"""
+        return self._attacks[piece]
+
+    def move(self, source, destination, captured):
+        """Updates the map after the piece on source has moved to destination
+        capturing captured, which is '--' if nothing was captured"""
+        affected = self._watchers[source] | self._watchers[destination]
+        if captured != '--':
+            self._remove(captured)
+            affected.discard(captured)
+        piece = self._board[destination // 9][destination % 9]
+        self._remove(piece)
+        self._add(piece, destination)
+        affected.discard(piece)
+        for item in affected:
+            square = self._squares[item]
+            self._remove(item)
+            self._add(item, square)
+
+    def unmove(self, source, destination, captured):
+        """Updates the map after a move from source to destination has been
+        taken back and captured put back on destination"""
+        affected = self._watchers[source] | self._watchers[destination]
+        piece = self._board[source // 9][source % 9]
+        self._remove(piece)
+        self._add(piece, source)
+        affected.discard(piece)
+        if captured != '--':
+            self._add(captured, destination)
+        for item in affected:
+            square = self._squares[item]
+            self._remove(item)
+            self._add(item, square)
+
+    def _add(self, piece, square):
+        """Adds the attacks of a piece standing on square"""
+        attacks, depends = self._piece_attacks(piece, square)
+        counts = self._counts[piece.get_color()]
+        for attacked in attacks:
+            counts[attacked] += 1
+        for depended in depends:
+            self._watchers[depended].add(piece)
+        self._attacks[piece] = attacks
+        self._depends[piece] = depends
+        self._squares[piece] = square
+
+    def _remove(self, piece):
+        """Removes the attacks of a piece"""
+        counts = self._counts[piece.get_color()]
+        for attacked in self._attacks.pop(piece):
+            counts[attacked] -= 1
+        for depended in self._depends.pop(piece):
+            self._watchers[depended].discard(piece)
+        del self._squares[piece]
+
+    def _piece_attacks(self, piece, square):
+        """Returns the list of squares a piece on square attacks and the list
+        of squares whose contents those attacks depend on. Follows the same
+        rules as XiangqiGame.legality_check, with the squares each piece can
+        reach from each square looked up in the rule tables."""
+        board = self._board
+        tables = self._tables
+        piece_type = piece.print_piece()[1]
+        attacks = []
+        depends = []
+
+        # Rooks attack along each line up to and including the first piece.
+        # Cannons attack past the first piece up to and including the next.
+        if piece_type == 'R' or piece_type == 'C':
+            starts = tables.ray_start
+            rays = tables.rays
+            for ray in range(square * 4, square * 4 + 4):
+                jumped = piece_type == 'R'
+                for target in rays[starts[ray]:starts[ray + 1]]:
+                    depends.append(target)
+                    occupied = board[target // 9][target % 9] != '--'
+                    if jumped:
+                        attacks.append(target)
+                        if occupied:
+                            break
+                    elif occupied:
+                        jumped = True
+
+        # Horses, blocked by a piece on the leg next to them, and elephants,
+        # blocked by a piece on the eye between. The tables hold (leg or eye,
+        # destination) pairs.
+        elif piece_type == 'H' or piece_type == 'E':
+            if piece_type == 'H':
+                starts = tables.horse_start
+                pairs = tables.horse
+            else:
+                starts = tables.elephant_start
+                pairs = tables.elephant
+            for index in range(starts[square], starts[square + 1], 2):
+                blocker = pairs[index]
+                depends.append(blocker)
+                if board[blocker // 9][blocker % 9] == '--':
+                    attacks.append(pairs[index + 1])
+
+        # Advisors and generals stay in their own palace, and soldiers move
+        # forward, and sideways too once across the river. Their moves don't
+        # depend on other squares.
+        else:
+            if piece_type == 'A':
+                starts = tables.advisor_start
+                targets = tables.advisor
+            elif piece_type == 'G':
+                starts = tables.general_start
+                targets = tables.general
+            else:
+                starts = tables.soldier_start
+                targets = tables.soldier
+            index = square + (90 if piece.get_color() == 'b' else 0)
+            attacks.extend(targets[starts[index]:starts[index + 1]])
+
+        return attacks, depends
+
+
 class Piece:
     """
     Every piece will inherit from Piece and have a get_color and print_piece
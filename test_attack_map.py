@@ -0,0 +1,64 @@
+# Description: Regression tests for the incremental AttackMap behind
+# XiangqiGame.check_for_check. Random games are played and, after every move,
+# the map is compared with one built from scratch and check status with a scan
+# of every enemy piece's legality_check.
+
+import random
+import unittest
+
+from XiangqiGame import XiangqiGame, AttackMap
+from xiangqi_search import side_pieces
+
+
+def scan_for_check(game):
+    """Returns True if the player to move is in check, worked out without
+    the attack map the way check_for_check used to"""
+    if game.is_flying_general():
+        return True
+    if game._turn == 'r':
+        general = game._rG
+        opponent = 'b'
+    else:
+        general = game._bG
+        opponent = 'r'
+    for item in side_pieces(game, opponent):
+        if general.get_coordinate() in game.legality_check(item):
+            return True
+    return False
+
+
+def random_games(count, max_plies, seed):
+    """Generator of a game after each move of count seeded random games"""
+    rng = random.Random(seed)
+    for _ in range(count):
+        game = XiangqiGame()
+        for _ in range(max_plies):
+            moves = [(item.get_coordinate(), destination)
+                     for item in side_pieces(game, game._turn)
+                     for destination in game.legality_check(item)]
+            rng.shuffle(moves)
+            for move in moves:
+                if game.make_move(*move):
+                    break
+            yield game
+            if game.get_game_state() != "UNFINISHED":
+                break
+
+
+class AttackMapTest(unittest.TestCase):
+
+    def test_matches_fresh_map(self):
+        for game in random_games(10, 100, 1):
+            fresh = AttackMap(game.get_board())
+            self.assertEqual(fresh._counts, game._attack_map._counts)
+
+    def test_check_matches_scan(self):
+        for game in random_games(10, 100, 2):
+            for _ in range(2):
+                self.assertEqual(scan_for_check(game),
+                                 game.check_for_check())
+                game.change_turn()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# Description: Tests for Move parsing and the trusted apply_moves fast path.
+# Trusted replays must reach the same position, check status and game state
+# as playing the same moves through make_move.
+
+import unittest
+
+from XiangqiGame import XiangqiGame, Move
+from xiangqi_bench import REPLAY_GAME
+from xiangqi_search import SQUARES
+
+
+# Red mates in two from this position with these moves
+MATE_IN_2 = '3a3R1/4k4/9/9/3C5/9/9/9/3K4R/9 w'
+MATING_MOVES = ['i2i9', 'e9e8', 'h10h8']
+
+
+def status(game):
+    """Returns what a game reports about its position"""
+    return (game.get_fen(), game.is_in_check('red'),
+            game.is_in_check('black'), game.get_game_state())
+
+
+class MoveTest(unittest.TestCase):
+
+    def test_parse(self):
+        move = Move('h3', 'e3')
+        self.assertEqual(Move.parse('h3e3'), move)
+        self.assertEqual(Move.parse('H3-E3'), move)
+        self.assertEqual(Move.parse(('h3', 'e3')), move)
+        self.assertEqual(tuple(Move.parse('a10a9')), ('a10', 'a9'))
+        for text in ('h3', 'j3e3', 'h0e3', 'h11e3'):
+            with self.assertRaises(ValueError):
+                Move.parse(text)
+
+    def test_iccs_round_trip(self):
+        for source in SQUARES:
+            for destination in SQUARES:
+                move = Move(source, destination)
+                self.assertEqual(Move.from_iccs(move.to_iccs()), move)
+        self.assertEqual(Move.from_iccs('h2e2'), Move('h3', 'e3'))
+        self.assertEqual(Move('a10', 'a9').to_iccs(), 'a9a8')
+
+
+class ApplyMovesTest(unittest.TestCase):
+
+    def test_trusted_matches_validated(self):
+        validated = XiangqiGame()
+        for ply, text in enumerate(REPLAY_GAME):
+            self.assertTrue(validated.make_move(text))
+            if ply % 10 == 9:
+                trusted = XiangqiGame()
+                self.assertTrue(trusted.apply_moves(REPLAY_GAME[:ply + 1],
+                                                    validate=False))
+                self.assertEqual(status(trusted), status(validated))
+
+    def test_trusted_then_make_move(self):
+        game = XiangqiGame()
+        game.apply_moves(REPLAY_GAME[:40], validate=False)
+        replayed = XiangqiGame()
+        replayed.apply_moves(REPLAY_GAME[:40])
+        for text in REPLAY_GAME[40:]:
+            self.assertEqual(game.make_move(text), replayed.make_move(text))
+        self.assertEqual(status(game), status(replayed))
+        self.assertEqual(game._attack_map._counts,
+                         replayed._attack_map._counts)
+
+    def test_trusted_mate(self):
+        game = XiangqiGame()
+        game.set_fen(MATE_IN_2)
+        self.assertTrue(game.apply_moves(MATING_MOVES, validate=False))
+        self.assertEqual(game.get_game_state(), 'RED_WON')
+        self.assertTrue(game.is_in_check('black'))
+        self.assertFalse(game.make_move('e8', 'e9'))
+        self.assertFalse(game.apply_moves(['e8e9'], validate=False))
+
+    def test_validated_stops_at_illegal_move(self):
+        game = XiangqiGame()
+        self.assertFalse(game.apply_moves(['h3e3', 'a1a3', 'h10g8']))
+        played = XiangqiGame()
+        played.make_move('h3', 'e3')
+        self.assertEqual(status(game), status(played))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# Description: Tests for the spectator broadcaster. Spectators fed from a
+# subscriber queue must end up in the same position as the game they watch.
+
+import unittest
+
+from XiangqiGame import XiangqiGame
+from xiangqi_bench import REPLAY_GAME
+from xiangqi_broadcast import (Broadcaster, Spectator, decode_message, DELTA,
+                               KEYFRAME)
+
+
+def drain(subscriber, spectator):
+    """Passes every queued message to the spectator"""
+    while not subscriber.empty():
+        spectator.receive(subscriber.get())
+
+
+class BroadcasterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.game = XiangqiGame()
+        self.broadcaster = Broadcaster(self.game)
+        self.subscriber = self.broadcaster.subscribe()
+        self.spectator = Spectator()
+
+    def assert_synced(self, subscriber=None, spectator=None):
+        """Drains a subscriber and checks its spectator matches the game"""
+        subscriber = subscriber or self.subscriber
+        spectator = spectator or self.spectator
+        drain(subscriber, spectator)
+        self.assertTrue(spectator.is_synced())
+        self.assertEqual(spectator.get_game().get_fen(), self.game.get_fen())
+
+    def test_moves(self):
+        for move in ('h3e3', 'h10g8', 'h1g3', 'i10h10'):
+            self.assertTrue(self.game.make_move(move))
+            self.assertEqual(len(self.broadcaster.publish()), 12)
+            self.assert_synced()
+
+    def test_subscribe_between_move_and_publish(self):
+        self.game.make_move('h3e3')
+        self.broadcaster.publish()
+        self.game.make_move('h10g8')
+        late_subscriber = self.broadcaster.subscribe()
+        late_spectator = Spectator()
+        self.broadcaster.publish()
+        self.assert_synced()
+        self.assert_synced(late_subscriber, late_spectator)
+
+    def test_rejected_move(self):
+        self.game.make_move('h3e3')
+        self.broadcaster.publish()
+        self.assertFalse(self.game.make_move('a1a9'))
+        self.broadcaster.publish()
+        self.assert_synced()
+
+    def test_several_moves_then_publish(self):
+        self.game.apply_moves(['h3e3', 'h10g8', 'h1g3'])
+        self.broadcaster.publish()
+        self.assert_synced()
+
+    def test_two_make_moves_then_publish(self):
+        self.game.make_move('h3e3')
+        self.game.make_move('h10g8')
+        message = self.broadcaster.publish()
+        self.assertEqual(decode_message(message)[0], KEYFRAME)
+        self.assert_synced()
+
+    def test_set_fen_then_move(self):
+        self.game.make_move('h3e3')
+        self.broadcaster.publish()
+        self.game.set_fen('3a3R1/4k4/9/9/3C5/9/9/9/3K4R/9 w')
+        self.game.make_move('i2i9')
+        self.broadcaster.publish()
+        self.assert_synced()
+
+    def test_nothing_to_publish(self):
+        self.game.make_move('h3e3')
+        self.broadcaster.publish()
+        self.assertIsNone(self.broadcaster.publish())
+
+    def test_whole_game(self):
+        kinds = []
+        late_subscriber = None
+        late_spectator = Spectator()
+        for ply, text in enumerate(REPLAY_GAME):
+            self.assertTrue(self.game.make_move(text))
+            kinds.append(decode_message(self.broadcaster.publish())[0])
+            self.assert_synced()
+            if ply == 50:
+                late_subscriber = self.broadcaster.subscribe()
+        self.assert_synced(late_subscriber, late_spectator)
+        # A keyframe every 32 changes, the rest deltas
+        self.assertEqual([ply for ply, kind in enumerate(kinds, 1)
+                          if kind == KEYFRAME], [32, 64])
+        self.assertEqual(kinds.count(DELTA), 78)
+
+    def test_missed_delta(self):
+        self.game.make_move('h3e3')
+        self.broadcaster.publish()
+        drain(self.subscriber, self.spectator)
+        self.game.make_move('h10g8')
+        self.broadcaster.publish()
+        self.subscriber.get()
+        self.game.make_move('h1g3')
+        self.broadcaster.publish()
+        self.assertFalse(self.spectator.receive(self.subscriber.get()))
+        self.assertFalse(self.spectator.is_synced())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# Description: Tests for the dataset export. Each position must be exported
+# once across runs into the same directory, and the three files must stay
+# row aligned when an export stopped part way is reopened.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from xiangqi_bench import REPLAY_GAME
+from xiangqi_dataset import (DatasetExporter, DiskHashSet, NpyAppender,
+                             load_dataset, unpack_positions, RECORD_BYTES)
+from xiangqi_tournament import parse_move
+
+
+GAME = [parse_move(text) for text in REPLAY_GAME]
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class DatasetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def export(self, games, batch_size=16):
+        """Exports (result index, moves) games into the test directory"""
+        exporter = DatasetExporter(self.directory, hash_capacity=64,
+                                   batch_size=batch_size)
+        for result_index, moves in games:
+            exporter.add_game(result_index, moves)
+        exporter.close()
+
+    def rows(self):
+        """Returns the row counts of the three files"""
+        return tuple(len(array) for array in load_dataset(self.directory))
+
+    def test_export(self):
+        self.export([(0, GAME)])
+        positions, values, policy = load_dataset(self.directory)
+        self.assertEqual(self.rows(), (81, 81, 81))
+        codes, black_to_move = unpack_positions(positions)
+        self.assertEqual(codes.shape, (81, 90))
+        self.assertEqual(list(black_to_move[:4]), [0, 1, 0, 1])
+        self.assertEqual(list(values[:4]), [1, -1, 1, -1])
+        self.assertEqual(policy[-1], -1)
+
+    def test_reopen_deduplicates(self):
+        self.export([(0, GAME[:30]), (2, GAME[:10])])
+        self.assertEqual(self.rows(), (31, 31, 31))
+        self.export([(1, GAME), (0, GAME[:30])])
+        self.assertEqual(self.rows(), (81, 81, 81))
+
+    def test_stopped_before_flush(self):
+        # The exporter is dropped without close, as if the process died,
+        # after a batch was written but before the rest was
+        exporter = DatasetExporter(self.directory, batch_size=16)
+        exporter.add_game(0, GAME)
+        exporter._positions.append(bytes(RECORD_BYTES * 3))
+        del exporter
+        self.export([(0, GAME)])
+        self.assertEqual(self.rows(), (81, 81, 81))
+
+    def test_files_out_of_step(self):
+        self.export([(0, GAME[:20])])
+        values = NpyAppender(os.path.join(self.directory, 'values.npy'),
+                             numpy.int8)
+        values.append(numpy.zeros(5, dtype=numpy.int8))
+        values.close()
+        self.export([(0, GAME)])
+        self.assertEqual(self.rows(), (81, 81, 81))
+
+    def test_disk_hash_set(self):
+        path = os.path.join(self.directory, 'set.bin')
+        keys = DiskHashSet(path, capacity=4)
+        for key in range(0, 100, 3):
+            self.assertTrue(keys.add(key << 40))
+        self.assertFalse(keys.add(0))
+        keys.flush()
+        keys = DiskHashSet(path)
+        self.assertEqual(len(keys), 34)
+        self.assertIn(99 << 40, keys)
+        self.assertNotIn(98 << 40, keys)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# Description: Tests for checkpointed game history. Every ply reached by seek
+# or history must match replaying the game from the start.
+
+import unittest
+
+from XiangqiGame import XiangqiGame
+from xiangqi_bench import REPLAY_GAME
+from xiangqi_history import GameHistory
+
+
+def replayed(plies):
+    """Returns the FEN after the first plies moves of the replay game, played
+    through make_move"""
+    game = XiangqiGame()
+    game.apply_moves(REPLAY_GAME[:plies])
+    return game.get_fen()
+
+
+class GameHistoryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fens = [replayed(ply) for ply in range(len(REPLAY_GAME) + 1)]
+
+    def setUp(self):
+        self.history = GameHistory(checkpoint_interval=8)
+        self.assertTrue(self.history.extend(REPLAY_GAME))
+
+    def test_checkpoints(self):
+        self.assertEqual(len(self.history), 80)
+        self.assertEqual(self.history.get_checkpoint_count(), 11)
+
+    def test_seek(self):
+        for ply in range(len(REPLAY_GAME) + 1):
+            self.assertEqual(self.history.seek(ply).get_fen(),
+                             self.fens[ply])
+        self.assertEqual(self.history.seek(-1).get_fen(), self.fens[80])
+        self.assertEqual(self.history.seek(-81).get_fen(), self.fens[0])
+        for ply in (81, -82):
+            with self.assertRaises(IndexError):
+                self.history.seek(ply)
+
+    def test_seek_status(self):
+        game = self.history.seek(47)
+        played = XiangqiGame()
+        played.apply_moves(REPLAY_GAME[:47])
+        self.assertEqual(game.get_game_state(), played.get_game_state())
+        self.assertEqual(game.is_in_check('red'), played.is_in_check('red'))
+        self.assertEqual(game.is_in_check('black'),
+                         played.is_in_check('black'))
+
+    def test_history(self):
+        plies = []
+        for ply, move, game in self.history.history(5, 30):
+            plies.append(ply)
+            self.assertEqual(move, None if ply == 0 else
+                             self.history.get_moves()[ply - 1])
+            self.assertEqual(game.get_fen(), self.fens[ply])
+        self.assertEqual(plies, list(range(5, 31)))
+
+    def test_history_from_end(self):
+        steps = [(ply, game.get_fen())
+                 for ply, _, game in self.history.history(-3)]
+        self.assertEqual(steps, [(ply, self.fens[ply])
+                                 for ply in range(78, 81)])
+        self.assertEqual(self.history.seek(-1).get_fen(), self.fens[80])
+
+    def test_truncate(self):
+        self.history.truncate(20)
+        self.assertEqual(len(self.history), 20)
+        self.assertEqual(self.history.get_checkpoint_count(), 3)
+        self.assertEqual(self.history.seek(-1).get_fen(), self.fens[20])
+        self.assertTrue(self.history.extend(REPLAY_GAME[20:30]))
+        self.assertEqual(self.history.seek(30).get_fen(), self.fens[30])
+        self.assertFalse(self.history.append('a1a2'))
+        self.assertEqual(len(self.history), 30)
+
+    def test_trusted_moves(self):
+        history = GameHistory(checkpoint_interval=8)
+        self.assertTrue(history.extend(REPLAY_GAME, validate=False))
+        for ply in (0, 7, 8, 9, 80):
+            self.assertEqual(history.seek(ply).get_fen(), self.fens[ply])
+
+
+if __name__ == '__main__':
+    unittest.main()
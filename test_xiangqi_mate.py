@@ -0,0 +1,60 @@
+# Description: Tests for the mate-in-N solver. Solutions are replayed to check
+# the attacker has one move at each turn, every defender reply is answered and
+# every line ends in mate.
+
+import copy
+import unittest
+
+from XiangqiGame import XiangqiGame
+from xiangqi_mate import MateSolver, MATE, NO_MATE
+
+
+MATE_IN_2 = '3a3R1/4k4/9/9/3C5/9/9/9/3K4R/9 w'
+
+
+def game_from_fen(fen):
+    """Returns a game in the position of the FEN string"""
+    game = XiangqiGame()
+    game.set_fen(fen)
+    return game
+
+
+class MateSolverTest(unittest.TestCase):
+
+    def assert_solution(self, game, tree, attacker=True):
+        """Replays a solution tree, checking it forces mate"""
+        if not tree:
+            self.assertNotEqual(game.get_game_state(), "UNFINISHED")
+            return
+        if attacker:
+            self.assertEqual(len(tree), 1)
+        for move, subtree in tree.items():
+            after = copy.deepcopy(game)
+            self.assertTrue(after.make_move(*move))
+            self.assert_solution(after, subtree, not attacker)
+
+    def test_mate_in_2(self):
+        game = game_from_fen(MATE_IN_2)
+        result = MateSolver().solve(game, 2)
+        self.assertEqual(result.status, MATE)
+        self.assert_solution(game, result.solution)
+
+    def test_no_mate_in_1(self):
+        result = MateSolver().solve(game_from_fen(MATE_IN_2), 1)
+        self.assertEqual(result.status, NO_MATE)
+
+    def test_solve_twice(self):
+        # The second solve finds positions in the proof table that weren't
+        # expanded, and still has to build their part of the solution
+        game = game_from_fen(MATE_IN_2)
+        solver = MateSolver()
+        first = solver.solve(game, 2)
+        second = solver.solve(game, 2)
+        self.assertEqual(second.status, MATE)
+        self.assert_solution(game, second.solution)
+        self.assertEqual(first.principal_variation(),
+                         second.principal_variation())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# Description: Tests for the NNUE evaluator. The first layer kept up to date
+# by push and pop must match one worked out from scratch by refresh, and the
+# float64 later layers must match the same sums done in integers.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from XiangqiGame import XiangqiGame, Move
+from xiangqi_bench import REPLAY_GAME, middlegame
+from xiangqi_nnue import (NNUEEvaluator, NNUEWeights, feature_index,
+                          HIDDEN_SHIFT)
+from xiangqi_search import Searcher
+
+
+def integer_evaluate(weights, game):
+    """Returns the network's score for the game's position from the point of
+    view of the player to move, worked out from scratch in int64"""
+    views = []
+    for perspective in ('r', 'b'):
+        features = [feature_index(item.print_piece(),
+                                  row_index * 9 + column_index, perspective)
+                    for row_index, row in enumerate(game.get_board())
+                    for column_index, item in enumerate(row) if item != '--']
+        views.append(weights.b1 + weights.w1[features].astype(
+            numpy.int64).sum(axis=0))
+    if game._turn == 'b':
+        views.reverse()
+    inputs = numpy.clip(numpy.concatenate(views), 0, 127)
+    hidden = (inputs @ weights.w2.astype(numpy.int64) + weights.b2) >> \
+        HIDDEN_SHIFT
+    hidden = numpy.clip(hidden, 0, 127)
+    return ((int(hidden @ weights.w3.astype(numpy.int64)) + weights.b3) //
+            weights.output_scale)
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class NNUETest(unittest.TestCase):
+
+    def setUp(self):
+        self.weights = NNUEWeights.random(hidden1=64, hidden2=16, seed=3)
+
+    def test_push_matches_refresh(self):
+        game = XiangqiGame()
+        evaluator = NNUEEvaluator(self.weights)
+        fresh = NNUEEvaluator(self.weights)
+        evaluator.refresh(game)
+        for text in REPLAY_GAME:
+            move = Move.parse(text)
+            name = game.get_object_from_coord(move.source).print_piece()
+            captured = game.get_object_from_coord(move.destination)
+            self.assertTrue(game.make_move(move))
+            evaluator.push(name, move.source_square, move.destination_square,
+                           None if captured == '--'
+                           else captured.print_piece())
+            fresh.refresh(game)
+            self.assertTrue(numpy.array_equal(
+                evaluator._stack[evaluator._top], fresh._stack[0]))
+            self.assertEqual(evaluator.evaluate(game._turn),
+                             fresh.evaluate(game._turn))
+
+    def test_pop(self):
+        game = middlegame()
+        evaluator = NNUEEvaluator(self.weights)
+        evaluator.refresh(game)
+        before = evaluator.evaluate(game._turn)
+        evaluator.push('rR', 64, 1, 'bR')
+        evaluator.push('bC', 20, 26)
+        evaluator.pop()
+        evaluator.pop()
+        self.assertEqual(evaluator.evaluate(game._turn), before)
+
+    def test_matches_integer_sums(self):
+        game = XiangqiGame()
+        evaluator = NNUEEvaluator(self.weights)
+        for text in REPLAY_GAME[:30]:
+            game.make_move(text)
+            evaluator.refresh(game)
+            self.assertEqual(evaluator.evaluate(game._turn),
+                             integer_evaluate(self.weights, game))
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'weights.nnue')
+            self.weights.save(path)
+            loaded = NNUEEvaluator(path)
+        finally:
+            shutil.rmtree(directory)
+        original = NNUEEvaluator(self.weights)
+        game = middlegame()
+        original.refresh(game)
+        loaded.refresh(game)
+        self.assertEqual(loaded.evaluate('r'), original.evaluate('r'))
+        self.assertEqual(loaded.evaluate('b'), original.evaluate('b'))
+
+    def test_search(self):
+        game = middlegame()
+        move, _ = Searcher(evaluator=NNUEEvaluator(self.weights)).search(
+            game, 2)
+        self.assertTrue(game.make_move(*move))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+# Description: Tests for pondering. A ponderhit must hand back the ponder
+# search's result, or its failure, and a miss must fall back to a new search.
+
+import unittest
+
+from XiangqiGame import XiangqiGame
+from xiangqi_ponder import Ponderer
+from xiangqi_search import Searcher
+
+
+class FailingSearcher(Searcher):
+    """Searcher whose searches fail, standing in for a bug in the search"""
+
+    def search(self, game, depth, time_ms=None, stop_event=None,
+               nodes=None):
+        """Raises RuntimeError"""
+        raise RuntimeError('search failed')
+
+
+class PondererTest(unittest.TestCase):
+
+    def setUp(self):
+        self.game = XiangqiGame()
+        self.game.make_move('h3', 'e3')
+        self.ponderer = Ponderer(depth=2)
+
+    def test_ponderhit(self):
+        self.ponderer.start(self.game, ('h10', 'g8'))
+        self.game.make_move('h10', 'g8')
+        move, _ = self.ponderer.think(self.game)
+        self.assertFalse(self.ponderer.is_pondering())
+        self.assertTrue(self.game.make_move(*move))
+
+    def test_ponder_miss(self):
+        self.ponderer.start(self.game, ('h10', 'g8'))
+        self.game.make_move('b10', 'c8')
+        move, _ = self.ponderer.think(self.game)
+        self.assertTrue(self.game.make_move(*move))
+
+    def test_failed_ponder_search(self):
+        self.ponderer._new_searcher = lambda: FailingSearcher()
+        self.ponderer.start(self.game, ('h10', 'g8'))
+        self.game.make_move('h10', 'g8')
+        with self.assertRaises(RuntimeError):
+            self.ponderer.ponderhit()
+        self.assertFalse(self.ponderer.is_pondering())
+
+
+if __name__ == '__main__':
+    unittest.main()
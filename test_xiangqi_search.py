@@ -0,0 +1,145 @@
+# Description: Tests for the search's move ordering, static exchange
+# evaluation, quiescence search and multi-PV analysis, mostly on small
+# positions where the right answer can be worked out by hand.
+
+import threading
+import unittest
+
+from XiangqiGame import XiangqiGame
+from xiangqi_bench import middlegame
+from xiangqi_search import MoveOrderer, Searcher, TranspositionTable, see
+
+
+# Red rook on a5 facing a black soldier on a6, undefended, defended by a rook
+# and defended by a cannon through a horse screen
+UNDEFENDED = '5k3/9/9/9/p8/R8/9/9/9/3K5 w'
+ROOK_DEFENDED = 'r4k3/9/9/9/p8/R8/9/9/9/3K5 w'
+CANNON_DEFENDED = 'c4k3/9/n8/9/p8/R8/9/9/9/3K5 w'
+
+# As UNDEFENDED, with a red soldier on e6 that can take a black rook on e7
+TWO_CAPTURES = '5k3/9/9/4r4/p3P4/R8/9/9/9/3K5 w'
+
+
+def game_from_fen(fen):
+    """Returns a game in the position of the FEN string"""
+    game = XiangqiGame()
+    game.set_fen(fen)
+    return game
+
+
+class SeeTest(unittest.TestCase):
+
+    def test_undefended(self):
+        self.assertEqual(see(game_from_fen(UNDEFENDED), 'a5', 'a6'), 100)
+
+    def test_defended_by_rook(self):
+        self.assertEqual(see(game_from_fen(ROOK_DEFENDED), 'a5', 'a6'), -800)
+
+    def test_defended_by_cannon(self):
+        self.assertEqual(see(game_from_fen(CANNON_DEFENDED), 'a5', 'a6'),
+                         -800)
+
+    def test_board_restored(self):
+        game = game_from_fen(CANNON_DEFENDED)
+        see(game, 'a5', 'a6')
+        self.assertEqual(game.get_fen(), CANNON_DEFENDED)
+
+
+class MoveOrdererTest(unittest.TestCase):
+
+    def test_mvv_lva(self):
+        game = game_from_fen(TWO_CAPTURES)
+        self.assertEqual(MoveOrderer().capture_moves(game),
+                         [('e6', 'e7'), ('a5', 'a6')])
+
+    def test_stages(self):
+        game = game_from_fen(ROOK_DEFENDED)
+        orderer = MoveOrderer()
+        orderer.add_killer(0, ('d1', 'd2'))
+        orderer.add_history(('a5', 'a1'), 4)
+        moves = list(orderer.ordered_moves(game, 0, ('a5', 'i5')))
+        self.assertEqual(moves[:3], [('a5', 'i5'), ('d1', 'd2'),
+                                     ('a5', 'a1')])
+        # The capture loses the rook, so it comes after every quiet move
+        self.assertEqual(moves[-1], ('a5', 'a6'))
+        self.assertEqual(len(moves), len(set(moves)))
+
+    def test_killers_at_other_plies(self):
+        game = game_from_fen(ROOK_DEFENDED)
+        orderer = MoveOrderer()
+        orderer.add_killer(1, ('d1', 'd2'))
+        self.assertNotEqual(next(orderer.ordered_moves(game, 0)),
+                            ('d1', 'd2'))
+
+
+class QuiescenceTest(unittest.TestCase):
+
+    def test_takes_undefended_soldier(self):
+        move, score = Searcher().search(game_from_fen(UNDEFENDED), 1)
+        self.assertEqual(move, ('a5', 'a6'))
+        self.assertEqual(score, 900)
+
+    def test_avoids_defended_soldier(self):
+        move, score = Searcher().search(game_from_fen(ROOK_DEFENDED), 1)
+        self.assertNotEqual(move, ('a5', 'a6'))
+        self.assertEqual(score, -100)
+
+
+class AnalyzeTest(unittest.TestCase):
+
+    def test_multipv(self):
+        lines = Searcher().analyze(middlegame(), multipv=3, depth=2)
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(len({line[0] for line in lines}), 3)
+        scores = [line[1] for line in lines]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        for move, _, variation in lines:
+            self.assertEqual(variation[0], move)
+
+    def test_best_line_first(self):
+        game = middlegame()
+        move, score = Searcher().search(game, 2)
+        self.assertEqual(Searcher().analyze(game, multipv=4, depth=2)[0][:2],
+                         (move, score))
+
+    def test_node_limit_in_first_iteration(self):
+        # The limit runs out during the first iteration, which still gives
+        # the best move but not every line asked for
+        searcher = Searcher()
+        lines = searcher.analyze(middlegame(), multipv=20, nodes=1)
+        self.assertGreaterEqual(len(lines), 1)
+        self.assertLess(len(lines), 20)
+        self.assertEqual(searcher.get_completed_depth(), 0)
+
+    def test_fewer_moves_than_lines(self):
+        # 13 rook moves and 2 general moves
+        game = game_from_fen(UNDEFENDED)
+        lines = Searcher().analyze(game, multipv=50, depth=1)
+        self.assertEqual(len(lines), 15)
+
+
+class TranspositionTableTest(unittest.TestCase):
+
+    def test_shared_between_threads(self):
+        table = TranspositionTable(max_entries=64)
+        errors = []
+
+        def store(offset):
+            try:
+                for key in range(offset, offset + 20000):
+                    table.store(key, 1, 0, TranspositionTable.EXACT, None)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=store, args=(index * 100000,))
+                   for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(table), 64)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# Description: Tests for the position statistics. Counting a game file in
+# small shards that spill to disk must give the same file as counting it in
+# one pass held in memory.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from xiangqi_bench import REPLAY_GAME
+from xiangqi_stats import (aggregate, count_games, merge_runs, OpeningStats,
+                           RESULT_INDEXES)
+
+
+# Games sharing their openings, as (result code, number of replay game plies)
+GAMES = [('1-0', 80), ('0-1', 30), ('1/2', 12), ('1-0', 12), ('0-1', 2),
+         ('1/2', 0), ('1-0', 45), ('0-1', 60)]
+
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.games = os.path.join(self.directory, 'games.txt')
+        with open(self.games, 'w') as output:
+            for number, (result, plies) in enumerate(GAMES):
+                output.write(' '.join([result, str(number), 'a', 'b'] +
+                                      REPLAY_GAME[:plies]) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, name):
+        """Returns the contents of a file in the test directory"""
+        with open(os.path.join(self.directory, name), 'rb') as stats:
+            return stats.read()
+
+    def test_shards_and_spills_match_one_pass(self):
+        runs = count_games(self.games, spill_dir=self.directory)
+        self.assertEqual(len(runs), 1)
+        single = merge_runs(runs, os.path.join(self.directory, 'single'))
+        sharded = aggregate([self.games],
+                            os.path.join(self.directory, 'sharded'),
+                            workers=2, max_entries=16,
+                            spill_dir=self.directory, shard_bytes=200)
+        self.assertEqual(single, sharded)
+        self.assertEqual(self.read('single'), self.read('sharded'))
+
+    def test_lookup(self):
+        aggregate([self.games], os.path.join(self.directory, 'stats'),
+                  workers=1, spill_dir=self.directory)
+        stats = OpeningStats(os.path.join(self.directory, 'stats'))
+        try:
+            expected = [0, 0, 0]
+            for result, _ in GAMES:
+                expected[RESULT_INDEXES[result]] += 1
+            self.assertEqual(stats.lookup_moves([]), tuple(expected))
+            # Only the games of at least 12 plies reach this position
+            self.assertEqual(stats.lookup_moves(REPLAY_GAME[:12]), (3, 1, 2))
+            self.assertIsNone(stats.lookup_moves(['h3e3']))
+        finally:
+            stats.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
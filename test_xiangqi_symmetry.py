@@ -0,0 +1,98 @@
+# Description: Tests for symmetry canonicalization. The mirrored and flipped
+# images of a position must share its canonical key, and the incremental
+# SymmetricHash must agree with keys worked out from scratch.
+
+import unittest
+
+from XiangqiGame import XiangqiGame, Move
+from xiangqi_bench import middlegame, REPLAY_GAME
+from xiangqi_search import Searcher
+from xiangqi_symmetry import (canonical_key, symmetric_keys, transform_move,
+                              SymmetricHash, MIRROR, FLIP, MIRROR_FLIP)
+
+
+def game_from_fen(fen):
+    """Returns a game in the position of the FEN string"""
+    game = XiangqiGame()
+    game.set_fen(fen)
+    return game
+
+
+def expand(rank):
+    """Returns a FEN rank with its empty squares written out as dots"""
+    return ''.join('.' * int(letter) if letter.isdigit() else letter
+                   for letter in rank)
+
+
+def compress(rank):
+    """Returns a rank written by expand in FEN form again"""
+    result = ''
+    empty = 0
+    for letter in rank:
+        if letter == '.':
+            empty += 1
+            continue
+        if empty:
+            result += str(empty)
+            empty = 0
+        result += letter
+    return result + (str(empty) if empty else '')
+
+
+def transform_fen(transform, fen):
+    """Returns the FEN of a position's image under the transform"""
+    ranks, turn = fen.split()
+    ranks = [expand(rank) for rank in ranks.split('/')]
+    if transform == MIRROR or transform == MIRROR_FLIP:
+        ranks = [rank[::-1] for rank in ranks]
+    if transform == FLIP or transform == MIRROR_FLIP:
+        ranks = [rank.swapcase() for rank in reversed(ranks)]
+        turn = 'b' if turn == 'w' else 'w'
+    return '/'.join(compress(rank) for rank in ranks) + ' ' + turn
+
+
+class SymmetryTest(unittest.TestCase):
+
+    def test_images_share_canonical_key(self):
+        fen = middlegame().get_fen()
+        key = canonical_key(game_from_fen(fen))[0]
+        for transform in (MIRROR, FLIP, MIRROR_FLIP):
+            image = game_from_fen(transform_fen(transform, fen))
+            self.assertEqual(canonical_key(image)[0], key)
+
+    def test_canonical_move_round_trip(self):
+        game = middlegame()
+        move = ('a2', 'f2')
+        transform = canonical_key(game)[1]
+        stored = transform_move(transform, move)
+        for image_transform in (MIRROR, FLIP, MIRROR_FLIP):
+            image = game_from_fen(transform_fen(image_transform,
+                                                game.get_fen()))
+            image_move = transform_move(image_transform, move)
+            self.assertEqual(
+                transform_move(canonical_key(image)[1], stored), image_move)
+
+    def test_incremental_keys(self):
+        # Plays on through the bench game, which has captures in these plies
+        game = middlegame()
+        symmetric = SymmetricHash(game)
+        for text in REPLAY_GAME[40:60]:
+            move = Move.parse(text)
+            item = game.get_object_from_coord(move.source)
+            captured = game.get_object_from_coord(move.destination)
+            self.assertTrue(game.make_move(move))
+            symmetric.move(item.print_piece(), move.source_square,
+                           move.destination_square,
+                           None if captured == '--' else
+                           captured.print_piece())
+            symmetric.toggle_side()
+            self.assertEqual(symmetric._keys, symmetric_keys(game))
+
+    def test_search_with_symmetric_hash(self):
+        game = middlegame()
+        move, _ = Searcher(hash_type=SymmetricHash).search(game, 2)
+        self.assertTrue(game.make_move(*move))
+
+
+if __name__ == '__main__':
+    unittest.main()
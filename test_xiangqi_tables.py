@@ -0,0 +1,64 @@
+# Description: Tests for the shared rule table file. Importing the game and
+# search modules must not touch the file, which is only loaded or generated
+# when a position first needs it, and a file from another version of the
+# generator must be replaced.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from xiangqi_tables import (HEADER, MAGIC, VERSION, RuleTables,
+                            encode_tables, generator_checksum)
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Loads the tables by working out the key of the starting position
+FIRST_USE = ('import xiangqi_search, XiangqiGame\n'
+             'xiangqi_search.position_key(XiangqiGame.XiangqiGame())')
+
+
+def run(path, code):
+    """Runs code in a new interpreter with the table file at path"""
+    environment = dict(os.environ, XIANGQI_TABLES=path)
+    subprocess.run([sys.executable, '-c', code], cwd=DIRECTORY,
+                   env=environment, check=True)
+
+
+class TableFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tables.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_import_does_not_load(self):
+        run(self.path, 'import XiangqiGame, xiangqi_search, xiangqi_symmetry')
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_generated_on_first_use(self):
+        run(self.path, FIRST_USE)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_other_generator_regenerated(self):
+        # A file whose header names another generator, as if the tables had
+        # changed since it was written
+        contents = bytearray(encode_tables())
+        count = HEADER.unpack_from(contents)[3]
+        HEADER.pack_into(contents, 0, MAGIC, VERSION,
+                         generator_checksum() ^ 1, count)
+        with self.assertRaises(ValueError):
+            RuleTables(bytes(contents))
+        with open(self.path, 'wb') as output:
+            output.write(contents)
+        run(self.path, FIRST_USE)
+        with open(self.path, 'rb') as tables:
+            self.assertEqual(tables.read(), encode_tables())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+# Description: Benchmark suite for XiangqiGame. Each benchmark is warmed up,
+# then timed over repeated batches, and the per-call percentiles are written
+# as JSON. Two result files can be compared to flag regressions.
+
+import argparse
+import copy
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+
+from XiangqiGame import XiangqiGame, Move
+
+
+# A fixed 80 ply game used for replay benchmarks and to reach a middlegame
+# position. It is stored rather than generated so results stay comparable
+# when move generation changes.
+REPLAY_GAME = (
+    'c1a3 b8b7 h1g3 a10a8 b3b2 c10e8 b2b3 h8h6 i4i5 g7g6 h3h4 b7b5 h4h5 b5i5 '
+    'g3i2 i5i6 h5h3 e10e9 b3b2 a8c8 g1i3 b10a8 h3c3 h6h4 b1d2 e9e10 g4g5 i6i2 '
+    'b2a2 i2f2 a1b1 g10i8 b1b2 c8c9 b2b5 e8g10 c3h3 i7i6 b5b1 c9a9 b1b6 f2f3 '
+    'b6b4 f3f7 b4b3 h4h7 h3h4 i6i5 b3b10 a7a6 e4e5 a9d9 d1e2 i5h5 b10b8 f7f6 '
+    'e5e6 h7g7 b8a8 g6g5 h4g4 d9b9 a8a6 e7e6 a3c1 g7e7 a6a8 e6e5 d2e4 e7g7 '
+    'i3g1 i8g6 a8a9 b9b5 e4c5 i10i7 c5d7 g7g8 d7f6 i7e7').split()
+
+# Red to move and in check, with a move that gets out of it
+CHECK_FEN = ('r1bakann1/4c1r2/8b/6pc1/p1p5p/P7P/2P2pP2/N2CBA3/9/R2AK1BN1 w')
+CHECK_MOVE = ('e3', 'c5')
+
+# Red to move in the starting position
+QUIET_MOVE = ('h3', 'e3')
+
+
+def middlegame():
+    """Returns a game at the 40th ply of the replay game"""
+    game = XiangqiGame()
+    game.apply_moves(REPLAY_GAME[:40], validate=False)
+    return game
+
+
+def first_piece(game, name):
+    """Returns the first piece with the given name on the game's board"""
+    for row in game.get_board():
+        for item in row:
+            if item != '--' and item.print_piece() == name:
+                return item
+    return None
+
+
+def time_calls(setup, call, number, repeat, warmup):
+    """Times call(state) for states made by setup, which isn't timed. Each of
+    the repeat samples times number calls in a batch. Returns the per-call
+    time of every sample in microseconds."""
+    for _ in range(warmup):
+        call(setup())
+
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            states = [setup() for _ in range(number)]
+            start = time.perf_counter()
+            for state in states:
+                call(state)
+            elapsed = time.perf_counter() - start
+            samples.append(elapsed / number * 1e6)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return samples
+
+
+def percentile(samples, fraction):
+    """Returns the percentile of the samples, interpolating between the
+    nearest two"""
+    ordered = sorted(samples)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position -
+                                                                  lower)
+
+
+def summarize(samples):
+    """Returns the statistics reported for a benchmark's samples"""
+    return {
+        'samples': len(samples),
+        'min_us': min(samples),
+        'mean_us': statistics.fmean(samples),
+        'median_us': percentile(samples, 0.5),
+        'p90_us': percentile(samples, 0.9),
+        'p99_us': percentile(samples, 0.99),
+        'stdev_us': statistics.stdev(samples) if len(samples) > 1 else 0.0
+    }
+
+
+def benchmarks():
+    """Returns the benchmarks as a list of (name, setup, call, number). number
+    is how many calls are timed per sample, sized so a sample takes a few
+    milliseconds."""
+    mid = middlegame()
+    check_game = XiangqiGame()
+    check_game.set_fen(CHECK_FEN)
+    replay = [Move.parse(move) for move in REPLAY_GAME]
+
+    suite = [
+        ('construct', lambda: None, lambda state: XiangqiGame(), 50),
+        ('check_for_check', lambda: mid,
+         lambda game: game.check_for_check(), 1000),
+        ('is_flying_general', lambda: mid,
+         lambda game: game.is_flying_general(), 1000),
+    ]
+    for name in ('rG', 'rA', 'rE', 'rH', 'rR', 'rC', 'rS'):
+        piece = first_piece(mid, name)
+        if piece is not None:
+            suite.append(('legality_check_' + name[1], lambda: mid,
+                          lambda game, piece=piece: game.legality_check(piece),
+                          200))
+    suite += [
+        ('make_move_quiet', XiangqiGame,
+         lambda game: game.make_move(*QUIET_MOVE), 20),
+        ('make_move_check', lambda: copy.deepcopy(check_game),
+         lambda game: game.make_move(*CHECK_MOVE), 20),
+        ('replay_make_move', XiangqiGame,
+         lambda game: [game.make_move(move) for move in replay], 1),
+        ('replay_apply_moves_trusted', XiangqiGame,
+         lambda game: game.apply_moves(replay, validate=False), 5),
+    ]
+    return suite
+
+
+def run(repeat=30, warmup=3, only=None):
+    """Runs every benchmark, or those named in only, and returns the results
+    as a dict ready to be written as JSON"""
+    results = {}
+    for name, setup, call, number in benchmarks():
+        if only and name not in only:
+            continue
+        results[name] = summarize(time_calls(setup, call, number, repeat,
+                                             warmup))
+    return {
+        'meta': {
+            'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': repeat,
+            'warmup': warmup
+        },
+        'results': results
+    }
+
+
+def compare(old, new, threshold=0.1, statistic='median_us'):
+    """Compares two result dicts. Returns a list of (name, old, new, change)
+    for every benchmark in both, and the names of those whose statistic grew
+    by more than threshold (0.1 is 10%)."""
+    rows = []
+    regressions = []
+    for name in sorted(old['results']):
+        if name not in new['results']:
+            continue
+        old_value = old['results'][name][statistic]
+        new_value = new['results'][name][statistic]
+        change = (new_value - old_value) / old_value if old_value else 0.0
+        rows.append((name, old_value, new_value, change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main():
+    """Command line entry point. Exits with status 1 if compare finds a
+    regression."""
+    parser = argparse.ArgumentParser(description='XiangqiGame benchmarks.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--output', help='JSON file for the results')
+    run_parser.add_argument('--repeat', type=int, default=30)
+    run_parser.add_argument('--warmup', type=int, default=3)
+    run_parser.add_argument('--only', nargs='*')
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+    compare_parser.add_argument('--statistic', default='median_us')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run(args.repeat, args.warmup, args.only)
+        for name, summary in results['results'].items():
+            print('%-28s median %12.2f us  p90 %12.2f us' %
+                  (name, summary['median_us'], summary['p90_us']))
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(results, output, indent=2)
+        return
+
+    with open(args.old) as old_file:
+        old = json.load(old_file)
+    with open(args.new) as new_file:
+        new = json.load(new_file)
+    rows, regressions = compare(old, new, args.threshold, args.statistic)
+    for name, old_value, new_value, change in rows:
+        flag = '  REGRESSION' if name in regressions else ''
+        print('%-28s %12.2f -> %12.2f us  %+7.1f%%%s' %
+              (name, old_value, new_value, change * 100, flag))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+# Description: Spectator feeds for XiangqiGame. After each move the game's
+# last change is encoded as a 12 byte delta message and fanned out to every
+# subscriber, in process through queues or over a local TCP socket. Keyframes
+# holding the whole position as FEN are sent periodically, after missed
+# changes and to late joiners, so spectators can sync without the full board
+# being sent per move.
+
+import queue
+import socket
+import socketserver
+import struct
+import threading
+
+from XiangqiGame import XiangqiGame
+from xiangqi_search import SQUARES, SQUARE_INDEX, PIECE_NAMES
+
+
+# Every message is framed by its length, then has a type, the sequence number
+# of the update it carries and the update itself. Sequence numbers are the
+# game's change numbers, see XiangqiGame.get_change_number.
+FRAME = struct.Struct('<H')
+MESSAGE = struct.Struct('<cI')
+DELTA = b'D'
+KEYFRAME = b'K'
+
+# Delta body: piece, source square, destination square, captured piece and
+# flags. Pieces are 1 + their index in PIECE_NAMES, with 0 for no capture.
+DELTA_BODY = struct.Struct('<BBBBB')
+
+# Flags pack red in check in bit 0, black in check in bit 1 and the game
+# state's index in bits 2-3
+GAME_STATES = ['UNFINISHED', 'RED_WON', 'BLACK_WON']
+
+PIECE_CODES = {name: index + 1 for index, name in enumerate(PIECE_NAMES)}
+
+
+def encode_flags(red_check, black_check, game_state):
+    """Returns the flags byte for a check status and game state"""
+    return ((1 if red_check else 0) | (2 if black_check else 0) |
+            GAME_STATES.index(game_state) << 2)
+
+
+def decode_flags(flags):
+    """Returns (red in check, black in check, game state) from a flags
+    byte"""
+    return bool(flags & 1), bool(flags & 2), GAME_STATES[flags >> 2 & 3]
+
+
+def _frame(body):
+    """Returns a message body with its length in front"""
+    return FRAME.pack(len(body)) + body
+
+
+def encode_delta(sequence, change):
+    """Returns the framed delta message for a change from get_last_change"""
+    piece, source, destination, captured, red_check, black_check, \
+        game_state = change[:7]
+    return _frame(MESSAGE.pack(DELTA, sequence) + DELTA_BODY.pack(
+        PIECE_CODES[piece], SQUARE_INDEX[source], SQUARE_INDEX[destination],
+        0 if captured is None else PIECE_CODES[captured],
+        encode_flags(red_check, black_check, game_state)))
+
+
+def encode_keyframe(sequence, game):
+    """Returns the framed keyframe message for the game's position"""
+    flags = encode_flags(game.is_in_check('red'), game.is_in_check('black'),
+                         game.get_game_state())
+    return _keyframe_message(sequence, flags, game.get_fen())
+
+
+def _keyframe_message(sequence, flags, fen):
+    """Returns the framed keyframe message for a FEN and flags byte"""
+    return _frame(MESSAGE.pack(KEYFRAME, sequence) + bytes([flags]) +
+                  fen.encode())
+
+
+def decode_message(frame):
+    """Decodes a framed message. Returns (DELTA, sequence, change) with the
+    change in the get_last_change form, its change number being the
+    sequence, or (KEYFRAME, sequence, (fen, red in check, black in check,
+    game state)). Raises ValueError for anything else."""
+    length = FRAME.unpack_from(frame)[0]
+    if len(frame) != FRAME.size + length or length < MESSAGE.size + 1:
+        raise ValueError('Bad message length')
+    kind, sequence = MESSAGE.unpack_from(frame, FRAME.size)
+    offset = FRAME.size + MESSAGE.size
+    if kind == DELTA:
+        piece, source, destination, captured, flags = \
+            DELTA_BODY.unpack_from(frame, offset)
+        return DELTA, sequence, (
+            PIECE_NAMES[piece - 1], SQUARES[source], SQUARES[destination],
+            PIECE_NAMES[captured - 1] if captured else None) + \
+            decode_flags(flags) + (sequence,)
+    if kind == KEYFRAME:
+        return KEYFRAME, sequence, (frame[offset + 1:].decode(),) + \
+            decode_flags(frame[offset])
+    raise ValueError('Unknown message type')
+
+
+class Broadcaster:
+    """
+    Fans one game's updates out to its subscribers. Call publish after every
+    make_move (or any other change to the position) on the game. Each update
+    is encoded once and the same bytes are queued for every subscriber.
+    Every keyframe_interval changes a keyframe is sent in place of the
+    delta, and one is sent whenever changes were made since the last publish
+    that a single delta can't describe. A subscriber that falls queue_size
+    messages behind has its backlog dropped and gets a keyframe instead.
+
+    The position as last published is kept as a shadow board that deltas
+    update, so keyframes for new and lagging subscribers show what has been
+    published rather than the live game, which may already be ahead. They
+    are only encoded when one is needed.
+    """
+
+    def __init__(self, game, keyframe_interval=32, queue_size=256):
+        """Initializes a broadcaster for the game, with no subscribers"""
+        self._game = game
+        self._keyframe_interval = keyframe_interval
+        self._queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._sequence = game.get_change_number()
+        self._squares = None
+        self._turn = None
+        self._flags = None
+        self._keyframe = None
+        self._load_shadow()
+
+    def get_sequence(self):
+        """Returns the sequence number of the last update published"""
+        return self._sequence
+
+    def get_subscriber_count(self):
+        """Returns the number of subscribers"""
+        return len(self._subscribers)
+
+    def subscribe(self):
+        """Returns a new subscriber's queue of framed messages, starting with
+        a keyframe of the position last published. None is queued when the
+        broadcaster is closed."""
+        subscriber = queue.Queue(self._queue_size)
+        with self._lock:
+            subscriber.put(self._get_keyframe())
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """Stops sending to a subscriber's queue"""
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self):
+        """Sends the game's changes since the last publish to every
+        subscriber: a delta for a single move from make_move, or a keyframe
+        when the interval is reached or there is more to send than one move,
+        e.g. several moves were made or the position was set up some other
+        way. Returns the message sent, or None if the position hasn't changed
+        since the last publish."""
+        with self._lock:
+            sequence = self._game.get_change_number()
+            if sequence == self._sequence:
+                return None
+            change = self._game.get_last_change()
+            if (change is not None and sequence == self._sequence + 1 and
+                    sequence % self._keyframe_interval != 0):
+                message = encode_delta(sequence, change)
+                self._update_shadow(change)
+                self._sequence = sequence
+            else:
+                self._sequence = sequence
+                self._load_shadow()
+                message = self._get_keyframe()
+            for subscriber in self._subscribers:
+                self._send(subscriber, message)
+        return message
+
+    def _load_shadow(self):
+        """Sets the shadow board to the game's position and keeps the
+        keyframe for it"""
+        fen = self._game.get_fen()
+        self._flags = encode_flags(self._game.is_in_check('red'),
+                                   self._game.is_in_check('black'),
+                                   self._game.get_game_state())
+        ranks, self._turn = fen.split()
+        squares = []
+        for letter in ranks:
+            if letter.isdigit():
+                squares.extend([''] * int(letter))
+            elif letter != '/':
+                squares.append(letter)
+        self._squares = squares
+        self._keyframe = _keyframe_message(self._sequence, self._flags, fen)
+
+    def _update_shadow(self, change):
+        """Plays a change on the shadow board. The keyframe for the old
+        position is dropped."""
+        source = SQUARE_INDEX[change[1]]
+        destination = SQUARE_INDEX[change[2]]
+        self._squares[destination] = self._squares[source]
+        self._squares[source] = ''
+        self._turn = 'b' if self._turn == 'w' else 'w'
+        self._flags = encode_flags(change[4], change[5], change[6])
+        self._keyframe = None
+
+    def _get_keyframe(self):
+        """Returns the keyframe message for the shadow board, encoding it if
+        it isn't already"""
+        if self._keyframe is None:
+            ranks = []
+            for row in range(10):
+                rank = ''
+                empty = 0
+                for letter in self._squares[row * 9:row * 9 + 9]:
+                    if not letter:
+                        empty += 1
+                        continue
+                    if empty > 0:
+                        rank += str(empty)
+                        empty = 0
+                    rank += letter
+                if empty > 0:
+                    rank += str(empty)
+                ranks.append(rank)
+            self._keyframe = _keyframe_message(
+                self._sequence, self._flags,
+                '/'.join(ranks) + ' ' + self._turn)
+        return self._keyframe
+
+    def _send(self, subscriber, message, resync=True):
+        """Queues a message for a subscriber. If its queue is full, the
+        backlog is dropped and replaced with a keyframe, or with just the
+        message when resync is False."""
+        try:
+            subscriber.put_nowait(message)
+        except queue.Full:
+            while True:
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    break
+            subscriber.put_nowait(self._get_keyframe() if resync else message)
+
+    def close(self):
+        """Queues None for every subscriber and drops them"""
+        with self._lock:
+            for subscriber in self._subscribers:
+                self._send(subscriber, None, resync=False)
+            self._subscribers = set()
+
+
+class Spectator:
+    """
+    Keeps a copy of a watched game up to date from the messages of a
+    broadcaster. Deltas are only applied on top of the update before them,
+    so after a gap the spectator waits for the next keyframe.
+    """
+
+    def __init__(self):
+        """Initializes a spectator that hasn't synced yet"""
+        self._game = None
+        self._sequence = None
+
+    def get_game(self):
+        """Returns the spectator's copy of the game, or None before the first
+        keyframe"""
+        return self._game
+
+    def is_synced(self):
+        """Returns True if the copy is up to date with the messages
+        received"""
+        return self._sequence is not None
+
+    def receive(self, frame):
+        """Applies a framed message. Returns True if the copy is now up to
+        date, False if a delta was skipped because an update is missing."""
+        kind, sequence, update = decode_message(frame)
+        if kind == KEYFRAME:
+            if self._game is None:
+                self._game = XiangqiGame()
+            self._game.set_fen(update[0])
+            self._sequence = sequence
+            return True
+        if self._sequence is None or sequence != self._sequence + 1:
+            self._sequence = None
+            return False
+        self._game.apply_change(update)
+        self._sequence = sequence
+        return True
+
+
+class _SubscriberHandler(socketserver.BaseRequestHandler):
+    """Sends a broadcaster's messages to one connected spectator"""
+
+    def handle(self):
+        """Forwards messages until the broadcaster closes or the spectator
+        goes away. Messages already waiting are sent together."""
+        broadcaster = self.server.broadcaster
+        subscriber = broadcaster.subscribe()
+        try:
+            while True:
+                messages = [subscriber.get()]
+                while messages[-1] is not None:
+                    try:
+                        messages.append(subscriber.get_nowait())
+                    except queue.Empty:
+                        break
+                closed = messages[-1] is None
+                if closed:
+                    messages.pop()
+                if messages:
+                    self.request.sendall(b''.join(messages))
+                if closed:
+                    return
+        except OSError:
+            return
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+
+class BroadcastServer(socketserver.ThreadingTCPServer):
+    """
+    Serves a broadcaster's messages to spectators connecting over TCP, one
+    thread per connection. The server runs on a background thread once
+    started.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, broadcaster, host='127.0.0.1', port=0):
+        """Binds the server. Port 0 picks a free port, see get_address."""
+        super().__init__((host, port), _SubscriberHandler)
+        self.broadcaster = broadcaster
+        self._thread = None
+
+    def get_address(self):
+        """Returns the (host, port) the server listens on"""
+        return self.server_address
+
+    def start(self):
+        """Starts serving on a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stops serving and ends every connection"""
+        self.shutdown()
+        self.broadcaster.close()
+        self.server_close()
+        self._thread.join()
+
+
+def read_messages(connection):
+    """Generator of the framed messages received on a connected socket, until
+    the connection closes"""
+    buffered = b''
+    while True:
+        data = connection.recv(65536)
+        if not data:
+            return
+        buffered += data
+        while len(buffered) >= FRAME.size:
+            length = FRAME.size + FRAME.unpack_from(buffered)[0]
+            if len(buffered) < length:
+                break
+            yield buffered[:length]
+            buffered = buffered[length:]
+
+
+def connect(address):
+    """Returns a socket connected to a BroadcastServer at (host, port)"""
+    return socket.create_connection(address)
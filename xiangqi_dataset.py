@@ -0,0 +1,392 @@
+# Description: Exports every unique position reached in game files as training
+# data. Games are replayed without legality checks, positions are deduplicated
+# by Zobrist key with a hash set kept on disk, and packed position records with
+# value and policy labels are appended to .npy files that can be memory mapped
+# with numpy.load(path, mmap_mode='r'). Requires numpy.
+
+import argparse
+import ast
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from XiangqiGame import XiangqiGame
+from xiangqi_search import ZobristHash, SQUARE_INDEX
+from xiangqi_stats import read_games
+
+
+# Piece codes used in position records, 0 is an empty square
+PIECE_CODES = {
+    'rG': 1, 'rA': 2, 'rE': 3, 'rH': 4, 'rR': 5, 'rC': 6, 'rS': 7,
+    'bG': 8, 'bA': 9, 'bE': 10, 'bH': 11, 'bR': 12, 'bC': 13, 'bS': 14
+}
+
+# A record packs two 4 bit piece codes per byte for the 90 squares, then one
+# byte for the player to move, 0 for red and 1 for black
+RECORD_BYTES = 46
+
+# Game result index from the game file to the result for red
+RED_VALUES = [1, 0, -1]
+
+# Bytes reserved for .npy headers, so the shape can be rewritten in place as
+# rows are appended
+_NPY_HEADER_BYTES = 128
+
+
+def _require_numpy():
+    """Raises ImportError if numpy isn't installed"""
+    if numpy is None:
+        raise ImportError('xiangqi_dataset requires numpy')
+
+
+def pack_position(codes, black_to_move):
+    """Returns the packed record bytes for a list of 90 piece codes"""
+    record = bytearray(RECORD_BYTES)
+    for index in range(45):
+        record[index] = codes[2 * index] | (codes[2 * index + 1] << 4)
+    record[45] = 1 if black_to_move else 0
+    return bytes(record)
+
+
+def unpack_positions(records):
+    """Given an (N, 46) uint8 array of records, returns an (N, 90) uint8
+    array of piece codes and an (N,) array that is 1 where black is to
+    move"""
+    _require_numpy()
+    records = numpy.asarray(records, dtype=numpy.uint8)
+    codes = numpy.empty((records.shape[0], 90), dtype=numpy.uint8)
+    codes[:, 0::2] = records[:, :45] & 0x0F
+    codes[:, 1::2] = records[:, :45] >> 4
+    return codes, records[:, 45]
+
+
+class NpyAppender:
+    """
+    An .npy file that rows are appended to. The header is written with
+    spare room so the shape can be updated in place, which happens on every
+    flush. An existing file written by this class is reopened and appended
+    to. Only the rows counted by the header are kept when it is reopened, so
+    rows appended by a process that stopped before flushing are dropped.
+    """
+
+    def __init__(self, path, dtype, row_shape=()):
+        """Opens or creates the file for rows of the given dtype and shape"""
+        _require_numpy()
+        self._dtype = numpy.dtype(dtype)
+        self._row_shape = tuple(row_shape)
+        self._row_bytes = self._dtype.itemsize * int(numpy.prod(row_shape,
+                                                                dtype=int))
+        if os.path.exists(path):
+            self._file = open(path, 'r+b')
+            self.truncate(self._read_rows())
+        else:
+            self._file = open(path, 'w+b')
+            self._rows = 0
+            self._write_header()
+
+    def __len__(self):
+        """Returns the number of rows in the file"""
+        return self._rows
+
+    def _read_rows(self):
+        """Reads the row count from an existing file's header, checking the
+        file has this appender's layout"""
+        self._file.seek(0)
+        version = numpy.lib.format.read_magic(self._file)
+        if version != (1, 0) or self._file.tell() + 2 > _NPY_HEADER_BYTES:
+            raise ValueError('Not an appendable .npy file')
+        header_length = int.from_bytes(self._file.read(2), 'little')
+        if 10 + header_length != _NPY_HEADER_BYTES:
+            raise ValueError('Not an appendable .npy file')
+        header = ast.literal_eval(self._file.read(header_length).decode())
+        if (numpy.dtype(header['descr']) != self._dtype or
+                tuple(header['shape'][1:]) != self._row_shape):
+            raise ValueError('The .npy file has a different layout')
+        return header['shape'][0]
+
+    def _write_header(self):
+        """Writes the header for the current row count at the start of the
+        file"""
+        shape = (self._rows,) + self._row_shape
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+            self._dtype.str, shape)
+        header = header.ljust(_NPY_HEADER_BYTES - 10 - 1) + '\n'
+        position = self._file.tell()
+        self._file.seek(0)
+        self._file.write(b'\x93NUMPY\x01\x00')
+        self._file.write(len(header).to_bytes(2, 'little'))
+        self._file.write(header.encode())
+        if position > _NPY_HEADER_BYTES:
+            self._file.seek(position)
+
+    def append(self, data):
+        """Appends rows given as raw bytes or an array of the file's dtype"""
+        if not isinstance(data, (bytes, bytearray)):
+            data = numpy.ascontiguousarray(data, dtype=self._dtype).tobytes()
+        if len(data) % self._row_bytes != 0:
+            raise ValueError('Data is not a whole number of rows')
+        self._file.write(data)
+        self._rows += len(data) // self._row_bytes
+
+    def truncate(self, rows):
+        """Drops every row after the first rows, so the next append follows
+        them"""
+        self._rows = rows
+        self._file.seek(_NPY_HEADER_BYTES + rows * self._row_bytes)
+        self._file.truncate()
+        self.flush()
+
+    def flush(self):
+        """Updates the header and flushes the file"""
+        self._write_header()
+        self._file.flush()
+
+    def close(self):
+        """Flushes and closes the file"""
+        self.flush()
+        self._file.close()
+
+
+class DiskHashSet:
+    """
+    A set of 64 bit keys in a memory mapped open addressing table, so the
+    set of seen positions doesn't have to fit in RAM. The table doubles when
+    it gets half full. Key 0 marks empty slots, so a key of 0 is stored as
+    1.
+    """
+
+    def __init__(self, path, capacity=1 << 20):
+        """Opens the table file at path, or creates it with capacity slots,
+        which is rounded up to a power of two"""
+        _require_numpy()
+        self._path = path
+        if os.path.exists(path):
+            self._table = numpy.memmap(path, dtype=numpy.uint64, mode='r+')
+            self._size = int(numpy.count_nonzero(self._table))
+        else:
+            slots = 1
+            while slots < capacity:
+                slots *= 2
+            self._table = numpy.memmap(path, dtype=numpy.uint64, mode='w+',
+                                       shape=(slots,))
+            self._size = 0
+        self._mask = len(self._table) - 1
+
+    def __len__(self):
+        """Returns the number of keys in the set"""
+        return self._size
+
+    def __contains__(self, key):
+        """Returns True if the key is in the set"""
+        return int(self._table[self._slot(key or 1)]) != 0
+
+    def _slot(self, key):
+        """Returns the slot holding a stored key, or the empty slot it would
+        go in"""
+        table = self._table
+        mask = self._mask
+        # Mix the low bits so keys differing only in high bits spread out
+        slot = (key ^ (key >> 29)) & mask
+        stored = int(table[slot])
+        while stored != 0 and stored != key:
+            slot = (slot + 1) & mask
+            stored = int(table[slot])
+        return slot
+
+    def add(self, key):
+        """Adds a key. Returns True if it was new, False if already there."""
+        key = key or 1
+        slot = self._slot(key)
+        if int(self._table[slot]) != 0:
+            return False
+        self._table[slot] = key
+        self._size += 1
+        if self._size * 2 > len(self._table):
+            self._grow()
+        return True
+
+    def _grow(self):
+        """Rehashes every key into a table twice the size"""
+        keys = self._table[self._table != 0].copy()
+        slots = len(self._table) * 2
+        del self._table
+        grown_path = self._path + '.grow'
+        self._table = numpy.memmap(grown_path, dtype=numpy.uint64, mode='w+',
+                                   shape=(slots,))
+        self._mask = slots - 1
+        self._size = 0
+        for key in keys.tolist():
+            self.add(key)
+        self._table.flush()
+        del self._table
+        os.replace(grown_path, self._path)
+        self._table = numpy.memmap(self._path, dtype=numpy.uint64, mode='r+')
+
+    def flush(self):
+        """Writes the table to disk"""
+        self._table.flush()
+
+
+class DatasetExporter:
+    """
+    Writes positions.npy (packed records, uint8 rows of 46 bytes),
+    values.npy (int8 result for the player to move: 1 win, 0 draw, -1 loss)
+    and policy.npy (int16 move played from the position as source square *
+    90 + destination square, -1 after the last move) into a directory, plus
+    seen.bin, the hash set of exported position keys. Only the first
+    occurrence of a position is exported. Exporting into a directory that
+    already holds a dataset adds to it. Keys only go into seen.bin once
+    their rows are written and counted in every file's header, so an export
+    that stops part way loses no positions when it is run again.
+    """
+
+    def __init__(self, directory, hash_capacity=1 << 20, batch_size=4096):
+        """Opens or creates the dataset in directory"""
+        _require_numpy()
+        os.makedirs(directory, exist_ok=True)
+        self._positions = NpyAppender(os.path.join(directory,
+                                                   'positions.npy'),
+                                      numpy.uint8, (RECORD_BYTES,))
+        self._values = NpyAppender(os.path.join(directory, 'values.npy'),
+                                   numpy.int8)
+        self._policy = NpyAppender(os.path.join(directory, 'policy.npy'),
+                                   numpy.int16)
+        self._seen = DiskHashSet(os.path.join(directory, 'seen.bin'),
+                                 hash_capacity)
+        self._batch_size = batch_size
+        self._records = []
+        self._value_batch = []
+        self._policy_batch = []
+        self._batch_keys = set()
+
+        # An export that stopped between writing one file and the next can
+        # leave one with more rows than the others. Those rows' keys never
+        # reached seen.bin, so they are dropped to be exported again.
+        rows = min(len(self._positions), len(self._values),
+                   len(self._policy))
+        for appender in (self._positions, self._values, self._policy):
+            if len(appender) > rows:
+                appender.truncate(rows)
+
+    def __len__(self):
+        """Returns the number of positions exported, including any still
+        waiting to be written"""
+        return len(self._positions) + len(self._records)
+
+    def add_game(self, result_index, moves):
+        """Replays a game from the start and adds each position not seen
+        before, labelled with the game's result (an index into the game
+        file's 1-0, 1/2, 0-1) and the move played next. The moves are
+        trusted and aren't checked for legality."""
+        game = XiangqiGame()
+        zobrist = ZobristHash(game)
+        codes = [0] * 90
+        index = 0
+        for row in game.get_board():
+            for item in row:
+                if item != '--':
+                    codes[index] = PIECE_CODES[item.print_piece()]
+                index += 1
+
+        red_value = RED_VALUES[result_index]
+        black_to_move = False
+        for ply in range(len(moves) + 1):
+            if ply < len(moves):
+                source = SQUARE_INDEX[moves[ply][0]]
+                destination = SQUARE_INDEX[moves[ply][1]]
+                policy = source * 90 + destination
+            else:
+                policy = -1
+
+            key = zobrist.key()
+            if key not in self._batch_keys and key not in self._seen:
+                self._batch_keys.add(key)
+                self._records.append(pack_position(codes, black_to_move))
+                self._value_batch.append(-red_value if black_to_move
+                                         else red_value)
+                self._policy_batch.append(policy)
+                if len(self._records) >= self._batch_size:
+                    self._write_batch()
+
+            if ply < len(moves):
+                name = game.get_object_from_coord(moves[ply][0]).print_piece()
+                captured = game.move_piece(moves[ply][0], moves[ply][1])
+                zobrist.move(name, source, destination,
+                             None if captured == '--'
+                             else captured.print_piece())
+                zobrist.toggle_side()
+                game.change_turn()
+                codes[destination] = codes[source]
+                codes[source] = 0
+                black_to_move = not black_to_move
+
+    def add_game_file(self, path):
+        """Adds every game in a game file written by xiangqi_tournament"""
+        for result_index, moves in read_games(path):
+            self.add_game(result_index, moves)
+
+    def _write_batch(self):
+        """Appends the buffered records to the files, updates their headers
+        and then marks the records' keys as seen"""
+        if not self._records:
+            return
+        self._positions.append(b''.join(self._records))
+        self._values.append(numpy.array(self._value_batch, dtype=numpy.int8))
+        self._policy.append(numpy.array(self._policy_batch,
+                                        dtype=numpy.int16))
+        self._positions.flush()
+        self._values.flush()
+        self._policy.flush()
+        for key in self._batch_keys:
+            self._seen.add(key)
+        self._records = []
+        self._value_batch = []
+        self._policy_batch = []
+        self._batch_keys = set()
+
+    def flush(self):
+        """Writes buffered records and brings every file up to date"""
+        self._write_batch()
+        self._seen.flush()
+
+    def close(self):
+        """Flushes and closes the dataset"""
+        self.flush()
+        self._positions.close()
+        self._values.close()
+        self._policy.close()
+
+
+def load_dataset(directory):
+    """Returns the positions, values and policy arrays of a dataset, memory
+    mapped read only"""
+    _require_numpy()
+    return tuple(numpy.load(os.path.join(directory, name), mmap_mode='r')
+                 for name in ('positions.npy', 'values.npy', 'policy.npy'))
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(
+        description='Export the unique positions in game files as a dataset.')
+    parser.add_argument('directory')
+    parser.add_argument('games', nargs='+')
+    parser.add_argument('--hash-capacity', type=int, default=1 << 20)
+    parser.add_argument('--batch-size', type=int, default=4096)
+    args = parser.parse_args()
+
+    exporter = DatasetExporter(args.directory, args.hash_capacity,
+                               args.batch_size)
+    try:
+        for path in args.games:
+            exporter.add_game_file(path)
+    finally:
+        exporter.close()
+    print('Positions:', len(exporter))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# Description: Game history for XiangqiGame with checkpoints. The moves are
+# kept as a compact list and a FEN snapshot is taken every K plies, so any ply
+# can be reached by restoring the nearest checkpoint and replaying at most K
+# moves instead of replaying the game from the start.
+
+from XiangqiGame import XiangqiGame, Move
+
+
+class GameHistory:
+    """
+    The moves of one game with a position snapshot every checkpoint_interval
+    plies. Memory grows with the number of plies divided by the interval, on
+    top of one Move per ply.
+    """
+
+    def __init__(self, checkpoint_interval=16, start_fen=None):
+        """Initializes an empty history starting from start_fen, or the
+        normal starting position"""
+        if checkpoint_interval < 1:
+            raise ValueError('checkpoint_interval must be at least 1')
+        self._interval = checkpoint_interval
+        self._tip = XiangqiGame()
+        if start_fen is not None:
+            self._tip.set_fen(start_fen)
+        self._moves = []
+        self._checkpoints = [self._tip.get_fen()]
+
+    def __len__(self):
+        """Returns the number of plies played"""
+        return len(self._moves)
+
+    def get_moves(self):
+        """Returns a copy of the list of moves played"""
+        return list(self._moves)
+
+    def get_checkpoint_count(self):
+        """Returns the number of position snapshots held"""
+        return len(self._checkpoints)
+
+    def append(self, move, validate=True):
+        """Adds the next move, a Move, coordinate pair or move string.
+        Returns False without adding it if validate is set and the move is
+        illegal. Moves from a trusted source can skip validation."""
+        move = Move.parse(move)
+        if validate:
+            if not self._tip.make_move(move):
+                return False
+        else:
+            self._tip.apply_moves([move], validate=False)
+        self._moves.append(move)
+        if len(self._moves) % self._interval == 0:
+            self._checkpoints.append(self._tip.get_fen())
+        return True
+
+    def extend(self, moves, validate=True):
+        """Adds a sequence of moves. Returns False at the first illegal one
+        if validate is set, keeping the moves before it."""
+        for move in moves:
+            if not self.append(move, validate):
+                return False
+        return True
+
+    def seek(self, ply):
+        """Returns a new XiangqiGame in the position after ply moves, made
+        from the nearest checkpoint at or before ply plus at most
+        checkpoint_interval - 1 replayed moves. Negative plies count back
+        from the end like list indexes."""
+        ply = self._ply_index(ply)
+        checkpoint = ply // self._interval
+        game = XiangqiGame()
+        game.set_fen(self._checkpoints[checkpoint])
+        replay = self._moves[checkpoint * self._interval:ply]
+        if replay:
+            game.apply_moves(replay, validate=False)
+        return game
+
+    def _ply_index(self, ply):
+        """Returns a ply with negative plies counted back from the end.
+        Raises IndexError if it is out of range."""
+        if ply < 0:
+            ply += len(self._moves) + 1
+        if not 0 <= ply <= len(self._moves):
+            raise IndexError('ply out of range')
+        return ply
+
+    def truncate(self, ply):
+        """Drops every move after ply, e.g. to take moves back or to start a
+        variation from there"""
+        if not 0 <= ply <= len(self._moves):
+            raise IndexError('ply out of range')
+        del self._moves[ply:]
+        del self._checkpoints[ply // self._interval + 1:]
+        self._tip = self.seek(ply)
+
+    def history(self, start=0, end=None):
+        """Generator of (ply, move, game) for each ply from start up to end,
+        where move is the move that led to the position (None at ply 0).
+        Negative plies count back from the end as for seek. The positions are
+        only built as the generator is advanced, and the same game object is
+        updated in place each time, so copy it to keep it. Its check status
+        and game state are only worked out if they are asked for."""
+        start = self._ply_index(start)
+        if end is None or end > len(self._moves):
+            end = len(self._moves)
+        elif end < 0:
+            end = self._ply_index(end)
+        if start > end:
+            return
+        game = self.seek(start)
+        yield start, self._moves[start - 1] if start > 0 else None, game
+        for ply in range(start + 1, end + 1):
+            move = self._moves[ply - 1]
+            game.apply_moves([move], validate=False)
+            yield ply, move, game
@@ -0,0 +1,280 @@
+# Description: Mate-in-N solver for XiangqiGame positions using proof-number
+# search. The attacker, the player to move, may only play checking moves and
+# the defender may play anything legal, so the search only follows forcing
+# lines. Solved positions are kept in a bounded proof table so transpositions
+# are not solved twice.
+
+import collections
+import copy
+
+from xiangqi_search import ZobristHash, SQUARE_INDEX, side_pieces
+
+
+INFINITY = 10 ** 9
+
+# Outcomes of a solve
+MATE = 'MATE'
+NO_MATE = 'NO_MATE'
+UNKNOWN = 'UNKNOWN'
+
+
+class _Node:
+    """A node of the proof-number search tree"""
+    __slots__ = ('move', 'parent', 'children', 'proof', 'disproof',
+                 'attacker', 'moves_left', 'terminal')
+
+    def __init__(self, move, parent, attacker, moves_left):
+        """Initializes an unexpanded node. attacker is True if the attacker
+        is to move in the node's position. moves_left is the number of
+        attacker moves still allowed."""
+        self.move = move
+        self.parent = parent
+        self.children = None
+        self.proof = 1
+        self.disproof = 1
+        self.attacker = attacker
+        self.moves_left = moves_left
+        self.terminal = False
+
+
+class MateResult:
+    """
+    The result of a solve. status is MATE, NO_MATE (proven that there is no
+    mate by checks within N moves) or UNKNOWN (the node limit ran out).
+    solution is the full solution tree for a mate: a dict of the attacker's
+    move to a dict of every defender reply to the next level of the tree,
+    ending in empty dicts where the defender is mated.
+    """
+
+    def __init__(self, status, solution, nodes):
+        """Initializes the result"""
+        self.status = status
+        self.solution = solution
+        self.nodes = nodes
+
+    def principal_variation(self):
+        """Returns one line of the solution, following the first reply at
+        every defender move"""
+        line = []
+        tree = self.solution
+        while tree:
+            move = next(iter(tree))
+            line.append(move)
+            tree = tree[move]
+        return line
+
+
+class MateSolver:
+    """
+    Proof-number search for mate in N. The proof table holds up to
+    table_size solved positions and drops the least recently used ones when
+    full.
+    """
+
+    def __init__(self, node_limit=200000, table_size=100000):
+        """Initializes the solver"""
+        self._node_limit = node_limit
+        self._table_size = table_size
+        self._table = collections.OrderedDict()
+        self._nodes = 0
+        self._hash = None
+
+    def solve(self, game, n):
+        """Looks for a mate in at most n moves by the player to move. The game
+        passed in is not modified. Returns a MateResult."""
+        self._nodes = 0
+        if game.get_game_state() != "UNFINISHED" or n < 1:
+            return MateResult(NO_MATE, None, 0)
+        game = copy.deepcopy(game)
+        self._hash = ZobristHash(game)
+
+        root = _Node(None, None, True, n)
+        self._search(game, root, self._node_limit)
+        if root.proof == 0:
+            return MateResult(MATE, self._solution(game, root), self._nodes)
+        if root.disproof == 0:
+            return MateResult(NO_MATE, None, self._nodes)
+        return MateResult(UNKNOWN, None, self._nodes)
+
+    def _search(self, game, root, node_limit=None):
+        """Runs proof-number search from root, whose position is the game's,
+        until it is proven, disproven or node_limit nodes have been expanded
+        in the solve"""
+        while (root.proof != 0 and root.disproof != 0 and
+               (node_limit is None or self._nodes < node_limit)):
+            # Walk down to the most proving node
+            node = root
+            path = []
+            while node.children is not None:
+                if node.attacker:
+                    node = min(node.children, key=lambda child: child.proof)
+                else:
+                    node = min(node.children, key=lambda child: child.disproof)
+                path.append((node.move, self._make(game, node.move)))
+
+            self._expand(game, node)
+
+            # Update the numbers on the way back up, taking the moves back as
+            # we go so solved nodes can be stored under their own position
+            while True:
+                self._update(node)
+                if node.proof == 0 or node.disproof == 0:
+                    self._store(node)
+                if node is root:
+                    break
+                move, captured = path.pop()
+                self._unmake(game, move, captured)
+                node = node.parent
+
+    def _expand(self, game, node):
+        """Creates the children of a node with their starting numbers"""
+        self._nodes += 1
+        children = []
+        for move in self._moves(game, node.attacker):
+            captured = self._make(game, move)
+            child = _Node(move, node, not node.attacker,
+                          node.moves_left - (1 if node.attacker else 0))
+            self._initialize(game, child)
+            self._unmake(game, move, captured)
+            children.append(child)
+        node.children = children
+
+    def _initialize(self, game, child):
+        """Sets a new child's numbers from its position, which the game is in.
+        A defender without a legal move is mated. An attacker without moves
+        left can't mate."""
+        if not child.attacker:
+            # Mobility of the defender is a good first guess at how hard the
+            # node is to prove
+            replies = len(self._moves(game, False))
+            if replies == 0:
+                child.proof = 0
+                child.disproof = INFINITY
+                child.terminal = True
+                return
+            if child.moves_left == 0:
+                child.proof = INFINITY
+                child.disproof = 0
+                return
+            child.disproof = 1
+            child.proof = replies
+
+        known = self._lookup(child)
+        if known is True:
+            child.proof = 0
+            child.disproof = INFINITY
+        elif known is False:
+            child.proof = INFINITY
+            child.disproof = 0
+
+    def _update(self, node):
+        """Recomputes a node's numbers from its children"""
+        if node.children is None:
+            return
+        if node.attacker:
+            # With no checking move the attacker node is disproven, as min of
+            # nothing is infinity and the sum is zero
+            node.proof = min([child.proof for child in node.children],
+                             default=INFINITY)
+            node.disproof = min(sum(child.disproof
+                                    for child in node.children), INFINITY)
+        else:
+            node.proof = min(sum(child.proof for child in node.children),
+                             INFINITY)
+            node.disproof = min([child.disproof for child in node.children],
+                                default=INFINITY)
+
+    def _moves(self, game, attacker):
+        """Returns the legal moves of the player to move, only those giving
+        check for the attacker"""
+        moves = []
+        for item in side_pieces(game, game._turn):
+            source = item.get_coordinate()
+            for destination in game.legality_check(item):
+                captured = game.move_piece(source, destination)
+                legal = not game.check_for_check()
+                if legal and attacker:
+                    game.change_turn()
+                    legal = game.check_for_check()
+                    game.change_turn()
+                game.unmove_piece(source, destination, captured)
+                if legal:
+                    moves.append((source, destination))
+        return moves
+
+    def _make(self, game, move):
+        """Plays a move known to be legal and passes the turn. Returns what
+        was captured."""
+        source, destination = move
+        name = game.get_object_from_coord(source).print_piece()
+        captured = game.move_piece(source, destination)
+        self._hash.move(name, SQUARE_INDEX[source], SQUARE_INDEX[destination],
+                        None if captured == '--' else captured.print_piece())
+        self._hash.toggle_side()
+        game.change_turn()
+        return captured
+
+    def _unmake(self, game, move, captured):
+        """Takes back a move made with _make"""
+        source, destination = move
+        game.change_turn()
+        game.unmove_piece(source, destination, captured)
+        name = game.get_object_from_coord(source).print_piece()
+        self._hash.move(name, SQUARE_INDEX[source], SQUARE_INDEX[destination],
+                        None if captured == '--' else captured.print_piece())
+        self._hash.toggle_side()
+
+    def _table_key(self, node):
+        """Returns the proof table key for a node in the current position"""
+        return self._hash.key(), node.moves_left, node.attacker
+
+    def _lookup(self, node):
+        """Returns True if the node's position is known to be proven, False
+        if known to be disproven, otherwise None. The game must be in the
+        node's position."""
+        key = self._table_key(node)
+        result = self._table.get(key)
+        if result is not None:
+            self._table.move_to_end(key)
+        return result
+
+    def _store(self, node):
+        """Records a solved node. The game must be in the node's position."""
+        key = self._table_key(node)
+        self._table[key] = node.proof == 0
+        self._table.move_to_end(key)
+        while len(self._table) > self._table_size:
+            self._table.popitem(last=False)
+
+    def _solution(self, game, node):
+        """Returns the solution tree below a proven node, whose position the
+        game is in. Proven nodes that weren't expanded, because the proof
+        table already knew them, are solved again here to fill in their
+        tree. That was done once within the node limit, so it isn't limited
+        again."""
+        if node.terminal:
+            return {}
+        if node.children is None:
+            # The table's answer is set aside so the search doesn't stop at
+            # once, and the node is expanded and proven again
+            node.proof = 1
+            node.disproof = 1
+            self._search(game, node)
+        tree = {}
+        if node.attacker:
+            # Any proven move will do, an immediate mate is preferred
+            proven = [child for child in node.children if child.proof == 0]
+            child = proven[0]
+            for candidate in proven:
+                if candidate.terminal:
+                    child = candidate
+                    break
+            captured = self._make(game, child.move)
+            tree[child.move] = self._solution(game, child)
+            self._unmake(game, child.move, captured)
+        else:
+            for child in node.children:
+                captured = self._make(game, child.move)
+                tree[child.move] = self._solution(game, child)
+                self._unmake(game, child.move, captured)
+        return tree
@@ -0,0 +1,220 @@
+# Description: NNUE style evaluation for the search. The first layer is a sum
+# of weight rows, one per (piece, square) on the board, kept for both red's
+# and black's view of the board and updated as moves are made and taken back
+# by adding and subtracting rows. Only the two small layers after it run per
+# evaluation. Weights are quantized to int16 for the first layer and int8 for
+# the rest, and are loaded from a compact binary file. Requires numpy.
+
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from xiangqi_search import PIECE_NAMES, MAX_PLY
+
+
+# One input feature per piece type and color on each square
+FEATURES = len(PIECE_NAMES) * 90
+
+# Weight file header: magic, version, first and second hidden layer sizes and
+# the divisor turning the network output into search score units (a soldier
+# is 100)
+HEADER = struct.Struct('<4sIIII')
+MAGIC = b'XQNN'
+VERSION = 1
+
+# First layer outputs are clipped to 0-127 before the second layer, and the
+# second layer's sums are shifted down by this many bits before clipping again
+HIDDEN_SHIFT = 6
+
+
+def _require_numpy():
+    """Raises ImportError if numpy isn't installed"""
+    if numpy is None:
+        raise ImportError('xiangqi_nnue requires numpy')
+
+
+def feature_index(name, square, perspective):
+    """Returns the input feature for a piece name such as 'rH' on a square
+    0-89, seen by perspective 'r' or 'b'. Black sees the board turned round
+    with the colors swapped, so both players' views share one set of
+    weights."""
+    if perspective == 'b':
+        name = ('b' if name[0] == 'r' else 'r') + name[1]
+        row, column = divmod(square, 9)
+        square = (9 - row) * 9 + column
+    return PIECE_NAMES.index(name) * 90 + square
+
+
+# The feature of each piece on each square for red's and black's view, so a
+# move's rows can be fetched for both views with one index
+_FEATURE_PAIRS = {name: [[feature_index(name, square, 'r'),
+                          feature_index(name, square, 'b')]
+                         for square in range(90)]
+                  for name in PIECE_NAMES}
+
+
+class NNUEWeights:
+    """
+    The network's quantized weights. The first layer's weights are int16 of
+    shape (FEATURES, hidden1), the second int8 of shape (2 * hidden1,
+    hidden2) and the output int8 of shape (hidden2,). The biases are int16
+    for the first layer and int32 after it.
+    """
+
+    def __init__(self, w1, b1, w2, b2, w3, b3, output_scale):
+        """Initializes the weights, checking their shapes agree"""
+        _require_numpy()
+        self.w1 = numpy.ascontiguousarray(w1, dtype=numpy.int16)
+        self.b1 = numpy.ascontiguousarray(b1, dtype=numpy.int16)
+        self.w2 = numpy.ascontiguousarray(w2, dtype=numpy.int8)
+        self.b2 = numpy.ascontiguousarray(b2, dtype=numpy.int32)
+        self.w3 = numpy.ascontiguousarray(w3, dtype=numpy.int8)
+        self.b3 = int(b3)
+        self.output_scale = int(output_scale)
+        hidden1 = self.b1.shape[0]
+        hidden2 = self.b2.shape[0]
+        if (self.w1.shape != (FEATURES, hidden1) or
+                self.w2.shape != (2 * hidden1, hidden2) or
+                self.w3.shape != (hidden2,) or self.output_scale < 1):
+            raise ValueError('NNUE weight shapes do not match')
+
+    def get_sizes(self):
+        """Returns the sizes of the two hidden layers"""
+        return self.b1.shape[0], self.b2.shape[0]
+
+    def save(self, path):
+        """Writes the weights to a weight file"""
+        hidden1, hidden2 = self.get_sizes()
+        with open(path, 'wb') as output:
+            output.write(HEADER.pack(MAGIC, VERSION, hidden1, hidden2,
+                                     self.output_scale))
+            for array in (self.w1, self.b1, self.w2, self.b2, self.w3):
+                output.write(array.astype(array.dtype.newbyteorder('<'),
+                                          copy=False).tobytes())
+            output.write(struct.pack('<i', self.b3))
+
+    @staticmethod
+    def load(path):
+        """Reads a weight file. Raises ValueError if it isn't one."""
+        _require_numpy()
+        with open(path, 'rb') as weights:
+            data = weights.read()
+        if len(data) < HEADER.size:
+            raise ValueError('Not an NNUE weight file: ' + path)
+        magic, version, hidden1, hidden2, output_scale = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not an NNUE weight file: ' + path)
+
+        arrays = []
+        offset = HEADER.size
+        for dtype, shape in (('<i2', (FEATURES, hidden1)), ('<i2', (hidden1,)),
+                             ('<i1', (2 * hidden1, hidden2)),
+                             ('<i4', (hidden2,)), ('<i1', (hidden2,))):
+            count = 1
+            for size in shape:
+                count *= size
+            array = numpy.frombuffer(data, dtype, count, offset)
+            arrays.append(array.reshape(shape))
+            offset += array.nbytes
+        if len(data) != offset + 4:
+            raise ValueError('NNUE weight file has the wrong size: ' + path)
+        b3 = struct.unpack_from('<i', data, offset)[0]
+        return NNUEWeights(*arrays, b3=b3, output_scale=output_scale)
+
+    @staticmethod
+    def random(hidden1=256, hidden2=32, seed=0):
+        """Returns small random weights, e.g. as a starting point for
+        training or to measure speed"""
+        _require_numpy()
+        generator = numpy.random.default_rng(seed)
+        return NNUEWeights(
+            generator.integers(-64, 64, (FEATURES, hidden1)),
+            generator.integers(0, 64, hidden1),
+            generator.integers(-32, 32, (2 * hidden1, hidden2)),
+            generator.integers(-512, 512, hidden2),
+            generator.integers(-32, 32, hidden2), 0, 16)
+
+
+class NNUEEvaluator:
+    """
+    Evaluates positions with NNUEWeights for Searcher. refresh sets up the
+    first layer from a game's board, then push and pop keep it in step with
+    the moves made and taken back. The first layer for every position on
+    the current line is kept on a stack, so pop only steps back.
+    """
+
+    def __init__(self, weights):
+        """Initializes the evaluator. weights is NNUEWeights or the path of a
+        weight file."""
+        _require_numpy()
+        if not isinstance(weights, NNUEWeights):
+            weights = NNUEWeights.load(weights)
+        self._weights = weights
+        hidden1 = weights.get_sizes()[0]
+        # The later layers are run in float64, which holds their integer sums
+        # exactly and is much faster for numpy than integer matrix products
+        self._w2 = weights.w2.astype(numpy.float64)
+        self._b2 = weights.b2.astype(numpy.float64)
+        self._w3 = weights.w3.astype(numpy.float64)
+        self._stack = numpy.zeros((MAX_PLY * 2, 2, hidden1),
+                                  dtype=numpy.int16)
+        self._top = 0
+
+    def refresh(self, game):
+        """Works out the first layer from scratch for the game's board and
+        empties the stack"""
+        red = []
+        black = []
+        square = 0
+        for row in game.get_board():
+            for item in row:
+                if item != '--':
+                    pair = _FEATURE_PAIRS[item.print_piece()][square]
+                    red.append(pair[0])
+                    black.append(pair[1])
+                square += 1
+        w1 = self._weights.w1
+        self._top = 0
+        self._stack[0, 0] = self._weights.b1 + w1[red].sum(axis=0,
+                                                            dtype=numpy.int16)
+        self._stack[0, 1] = self._weights.b1 + w1[black].sum(
+            axis=0, dtype=numpy.int16)
+
+    def push(self, name, source, destination, captured=None):
+        """Updates the first layer for a piece named name moving from square
+        source to square destination, taking a piece named captured"""
+        if self._top + 1 == len(self._stack):
+            self._stack = numpy.concatenate([self._stack,
+                                             numpy.zeros_like(self._stack)])
+        features = _FEATURE_PAIRS[name]
+        w1 = self._weights.w1
+        accumulator = self._stack[self._top + 1]
+        numpy.subtract(self._stack[self._top], w1[features[source], :],
+                       out=accumulator)
+        accumulator += w1[features[destination], :]
+        if captured is not None:
+            accumulator -= w1[_FEATURE_PAIRS[captured][destination], :]
+        self._top += 1
+
+    def pop(self):
+        """Takes back the last push"""
+        self._top -= 1
+
+    def evaluate(self, turn):
+        """Returns the score of the current position from the point of view
+        of turn, 'r' or 'b', in the search's units"""
+        # The player to move's view comes first
+        accumulator = self._stack[self._top]
+        if turn == 'b':
+            accumulator = accumulator[::-1]
+        inputs = numpy.clip(accumulator.reshape(-1), 0, 127).astype(
+            numpy.float64)
+        hidden = numpy.floor((inputs @ self._w2 + self._b2) /
+                             (1 << HIDDEN_SHIFT))
+        numpy.clip(hidden, 0, 127, out=hidden)
+        return (int(hidden @ self._w3) + self._weights.b3) // \
+            self._weights.output_scale
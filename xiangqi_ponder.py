@@ -0,0 +1,152 @@
+# Description: Pondering for a bot playing XiangqiGame. While the opponent
+# thinks, the expected reply is searched on a background thread using a clone
+# of the game, which keeps the shared transposition table warm. When the
+# opponent's move arrives the ponder search either carries on as the real
+# search (a ponderhit) or is cancelled.
+
+import copy
+import threading
+
+from xiangqi_search import Searcher, TranspositionTable, MoveOrderer
+from xiangqi_search import position_key
+
+
+class Ponderer:
+    """
+    Runs a bot's searches and ponders between them. Use think to get the
+    bot's move and start once the bot's move has been made on the game.
+    Neither call touches the game passed in, so the game's own make_move can
+    be used freely while a ponder search runs.
+    """
+
+    def __init__(self, depth=4, quiescence_checks=0, tt=None):
+        """Initializes the ponderer. depth is the deepest iteration searched,
+        for both pondering and thinking."""
+        if tt is None:
+            tt = TranspositionTable()
+        self._depth = depth
+        self._quiescence_checks = quiescence_checks
+        self._tt = tt
+        self._orderer = MoveOrderer()
+        self._thread = None
+        self._stop_event = None
+        self._searcher = None
+        self._ponder_key = None
+        self._ponder_move = None
+        self._result = None
+        self._error = None
+
+    def is_pondering(self):
+        """Returns True while a ponder search is running or waiting for the
+        opponent's move"""
+        return self._thread is not None
+
+    def get_ponder_move(self):
+        """Returns the opponent move being pondered on, or None"""
+        return self._ponder_move
+
+    def _new_searcher(self):
+        """Returns a searcher sharing the ponderer's table and move orderer"""
+        return Searcher(self._tt, self._orderer, self._quiescence_checks)
+
+    def expected_reply(self, game):
+        """Returns the reply the opponent is expected to play in the game's
+        position. The transposition table move from the bot's last search is
+        used when there is one, otherwise a one ply search picks it."""
+        entry = self._tt.probe(position_key(game))
+        if entry is not None and entry[3] is not None:
+            move = entry[3]
+            source_item = game.get_object_from_coord(move[0])
+            if source_item != '--' and source_item.get_color() == game._turn:
+                return move
+        return self._new_searcher().search(game, 1)[0]
+
+    def start(self, game, expected_move=None):
+        """Starts pondering on the game's position after expected_move, the
+        opponent's most likely reply. The expected reply is looked up when it
+        isn't given. Returns the move pondered on, or None if there is nothing
+        to ponder."""
+        self.cancel()
+        if game.get_game_state() != "UNFINISHED":
+            return None
+        if expected_move is None:
+            expected_move = self.expected_reply(game)
+            if expected_move is None:
+                return None
+
+        # The clone is made before the thread starts so the caller's game is
+        # never read while the caller might be changing it
+        ponder_game = copy.deepcopy(game)
+        if not ponder_game.make_move(*expected_move):
+            return None
+
+        self._ponder_key = position_key(ponder_game)
+        self._ponder_move = expected_move
+        self._stop_event = threading.Event()
+        self._searcher = self._new_searcher()
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._ponder, args=(ponder_game, self._searcher,
+                                       self._stop_event),
+            daemon=True)
+        self._thread.start()
+        return expected_move
+
+    def _ponder(self, game, searcher, stop_event):
+        """Ponder thread body. The result, or the exception the search
+        raised, is kept for a ponderhit."""
+        try:
+            self._result = searcher.search(game, self._depth,
+                                           stop_event=stop_event)
+        except Exception as error:
+            self._error = error
+
+    def cancel(self):
+        """Stops any ponder search and waits for its thread to finish. The
+        search checks for the stop on every node, so this returns within
+        about a node's time."""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self._stop_event = None
+        self._searcher = None
+        self._ponder_key = None
+        self._ponder_move = None
+
+    def ponderhit(self, time_ms=None):
+        """The opponent played the pondered move. The ponder search becomes
+        the real search, limited to time_ms more milliseconds, and its result
+        is returned as (move, score). If the ponder search failed, its
+        exception is raised here."""
+        thread = self._thread
+        self._searcher.set_time_limit(time_ms)
+        thread.join()
+        result = self._result
+        error = self._error
+        self._thread = None
+        self._stop_event = None
+        self._searcher = None
+        self._ponder_key = None
+        self._ponder_move = None
+        self._result = None
+        self._error = None
+        if error is not None:
+            raise error
+        return result
+
+    def think(self, game, time_ms=None):
+        """Returns the bot's (move, score) for the game's position. If the
+        position is the one being pondered the ponder search is converted,
+        otherwise it is cancelled and a new search is run with the warmed up
+        transposition table."""
+        if self._thread is not None:
+            if self._ponder_key == position_key(game):
+                move, score = self.ponderhit(time_ms)
+                if move is not None:
+                    return move, score
+            else:
+                self.cancel()
+        return self._new_searcher().search(game, self._depth, time_ms)
@@ -0,0 +1,819 @@
+# Description: Move ordering and alpha-beta search for XiangqiGame. Moves are
+# (source, destination) coordinate string pairs, the same as make_move takes.
+
+import copy
+import threading
+import time
+import weakref
+
+from xiangqi_tables import get_tables
+
+
+# Material values of the piece types, indexed by the second character of the
+# piece name
+PIECE_VALUES = {
+    'G': 10000,
+    'R': 900,
+    'C': 450,
+    'H': 400,
+    'E': 200,
+    'A': 200,
+    'S': 100
+}
+
+# Ranks used for MVV-LVA. Values are not used directly because the general
+# would swamp every other attacker.
+MVV_LVA_RANKS = {
+    'G': 7,
+    'R': 6,
+    'C': 5,
+    'H': 4,
+    'E': 2,
+    'A': 2,
+    'S': 1
+}
+
+# Board squares are numbered 0-89 from a10 across to i1, the same order as the
+# board array
+SQUARES = [column + str(10 - row) for row in range(10)
+           for column in 'abcdefghi']
+SQUARE_INDEX = {coord: index for index, coord in enumerate(SQUARES)}
+
+PIECE_NAMES = ['rG', 'rA', 'rE', 'rH', 'rR', 'rC', 'rS',
+               'bG', 'bA', 'bE', 'bH', 'bR', 'bC', 'bS']
+
+MATE_SCORE = 100000
+MAX_PLY = 64
+
+_zobrist = None
+
+
+def zobrist_keys():
+    """Returns the Zobrist keys as (keys, black), where keys maps each piece
+    name to its 90 keys and black is the key for black to move. They come
+    from the shared rule table file, which is only loaded on the first
+    call, so keys are identical across processes without each one
+    generating them."""
+    global _zobrist
+    if _zobrist is None:
+        tables = get_tables()
+        _zobrist = ({name: tables.zobrist_keys(name) for name in PIECE_NAMES},
+                    tables.zobrist_black())
+    return _zobrist
+
+
+def piece_value(item):
+    """Returns the material value of a piece object"""
+    return PIECE_VALUES[item.print_piece()[1]]
+
+
+def position_key(game):
+    """Returns the Zobrist key of the game's current position"""
+    keys, black = zobrist_keys()
+    key = 0
+    index = 0
+    for row in game.get_board():
+        for item in row:
+            if item != '--':
+                key ^= keys[item.print_piece()][index]
+            index += 1
+    if game._turn == 'b':
+        key ^= black
+    return key
+
+
+def side_pieces(game, color):
+    """Returns a list of the pieces of the given color ('r' or 'b')"""
+    pieces = []
+    for row in game.get_board():
+        for item in row:
+            if item != '--' and item.get_color() == color:
+                pieces.append(item)
+    return pieces
+
+
+def is_safe_capture(game, move):
+    """Returns True if the capture can't lose material whatever the reply,
+    because the victim is worth at least as much as the attacker"""
+    attacker = game.get_object_from_coord(move[0])
+    victim = game.get_object_from_coord(move[1])
+    return piece_value(victim) >= piece_value(attacker)
+
+
+def least_valuable_attacker(game, coord, color):
+    """Returns the least valuable piece of the given color that can capture on
+    coord in the current position, or None. Uses the piece's capture list so
+    cannon screens and horse legs are taken from the board as it stands."""
+    best = None
+    for item in side_pieces(game, color):
+        if best is not None and piece_value(item) >= piece_value(best):
+            continue
+        if coord in game.capture_check(item):
+            best = item
+    return best
+
+
+def see(game, source, destination):
+    """Static exchange evaluation. Returns the material the player moving
+    from source expects to win by capturing on destination, assuming both
+    sides keep recapturing with their least valuable piece and may stop
+    whenever continuing would lose material. The exchange is played out on
+    the board, so a piece that leaves a line can open a cannon screen or a
+    rook's path and a piece that arrives can block a horse leg. The board is
+    restored before returning. Pins are not taken into account."""
+    attacker = game.get_object_from_coord(source)
+    target = game.get_object_from_coord(destination)
+    gains = [piece_value(target) if target != '--' else 0]
+    on_square = piece_value(attacker)
+    color = 'b' if attacker.get_color() == 'r' else 'r'
+
+    made = [(source, game.move_piece(source, destination))]
+    while True:
+        item = least_valuable_attacker(game, destination, color)
+        if item is None:
+            break
+        # Gain for this side if it captures, assuming the opponent's best
+        # result so far is given up
+        gains.append(on_square - gains[-1])
+        on_square = piece_value(item)
+        item_source = item.get_coordinate()
+        made.append((item_source, game.move_piece(item_source, destination)))
+        color = 'b' if color == 'r' else 'r'
+
+    # Take the exchange back in reverse order
+    for item_source, captured in reversed(made):
+        game.unmove_piece(item_source, destination, captured)
+
+    # Either side can stop capturing when that is better for them
+    for depth in range(len(gains) - 1, 0, -1):
+        gains[depth - 1] = -max(-gains[depth - 1], gains[depth])
+    return gains[0]
+
+
+class MoveOrderer:
+    """
+    Orders moves for the search. Captures are scored by MVV-LVA, quiet moves
+    by killer slots per ply and a butterfly history table indexed by source
+    and destination square. The transposition table move is always tried
+    first.
+    """
+
+    def __init__(self, max_ply=MAX_PLY):
+        """Initializes two empty killer slots per ply and an empty history
+        table"""
+        self._max_ply = max_ply
+        self._killers = [[None, None] for _ in range(max_ply)]
+        self._history = [0] * (90 * 90)
+
+    def clear(self):
+        """Forgets all killers and history, used between unrelated games"""
+        self._killers = [[None, None] for _ in range(self._max_ply)]
+        self._history = [0] * (90 * 90)
+
+    def add_killer(self, ply, move):
+        """Records a quiet move that caused a cutoff at the given ply"""
+        if ply >= self._max_ply:
+            return
+        killers = self._killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+
+    def add_history(self, move, depth):
+        """Rewards a quiet move that caused a cutoff. Deeper cutoffs are worth
+        more. Scores are halved once they grow large so old results fade."""
+        index = SQUARE_INDEX[move[0]] * 90 + SQUARE_INDEX[move[1]]
+        self._history[index] += depth * depth
+        if self._history[index] > 1000000:
+            self._history = [score // 2 for score in self._history]
+
+    def history_score(self, move):
+        """Returns the history score of a quiet move"""
+        return self._history[SQUARE_INDEX[move[0]] * 90 +
+                             SQUARE_INDEX[move[1]]]
+
+    def mvv_lva(self, game, move):
+        """Scores a capture, most valuable victim first and least valuable
+        attacker second"""
+        attacker = game.get_object_from_coord(move[0])
+        victim = game.get_object_from_coord(move[1])
+        return (MVV_LVA_RANKS[victim.print_piece()[1]] * 8 -
+                MVV_LVA_RANKS[attacker.print_piece()[1]])
+
+    def is_pseudo_legal(self, game, move):
+        """Returns True if the move is a legal destination for a piece of the
+        player to move, not counting self check. Used for moves coming from
+        the transposition table or killer slots, which may belong to another
+        position."""
+        item = game.get_object_from_coord(move[0])
+        if item == '--' or item.get_color() != game._turn:
+            return False
+        return move[1] in game.legality_check(item)
+
+    def ordered_moves(self, game, ply, tt_move=None):
+        """Generator of pseudo-legal moves for the player to move in the order
+        they should be searched. Stages are the transposition table move,
+        captures by MVV-LVA, killer moves, the rest of the quiet moves by
+        history, then captures that lose material by SEE. Quiet moves are not
+        generated until every capture has been tried, so a cutoff on a
+        capture skips that work entirely."""
+        pieces = side_pieces(game, game._turn)
+
+        # Transposition table move
+        if tt_move is not None and self.is_pseudo_legal(game, tt_move):
+            yield tt_move
+        else:
+            tt_move = None
+
+        # Winning and even captures. Captures that lose material by static
+        # exchange evaluation are held back until every quiet move is tried.
+        bad_captures = []
+        for move in self.capture_moves(game, pieces):
+            if move == tt_move:
+                continue
+            if not is_safe_capture(game, move) and see(game, *move) < 0:
+                bad_captures.append(move)
+            else:
+                yield move
+
+        # Killer moves, only if they are quiet in this position
+        killers = []
+        if ply < self._max_ply:
+            for move in self._killers[ply]:
+                if (move is not None and move != tt_move and
+                        game.get_object_from_coord(move[1]) == '--' and
+                        self.is_pseudo_legal(game, move)):
+                    killers.append(move)
+                    yield move
+
+        # Quiet moves
+        quiets = []
+        for item in pieces:
+            source = item.get_coordinate()
+            for destination in game.legality_check(item):
+                if game.get_object_from_coord(destination) == '--':
+                    move = (source, destination)
+                    if move != tt_move and move not in killers:
+                        quiets.append((self.history_score(move), move))
+        quiets.sort(key=lambda scored: scored[0], reverse=True)
+        for scored in quiets:
+            yield scored[1]
+
+        # Losing captures
+        for move in bad_captures:
+            yield move
+
+    def capture_moves(self, game, pieces=None):
+        """Returns the pseudo-legal captures for the player to move ordered by
+        MVV-LVA"""
+        if pieces is None:
+            pieces = side_pieces(game, game._turn)
+        captures = []
+        for item in pieces:
+            source = item.get_coordinate()
+            for destination in game.capture_check(item):
+                move = (source, destination)
+                captures.append((self.mvv_lva(game, move), move))
+        captures.sort(key=lambda scored: scored[0], reverse=True)
+        return [scored[1] for scored in captures]
+
+
+class SearchStopped(Exception):
+    """Raised inside a search to unwind it when it has been told to stop"""
+    pass
+
+
+class ZobristHash:
+    """
+    Zobrist key of a position kept up to date as moves are made and taken
+    back. Moves stored against the key need no translation, see
+    xiangqi_symmetry.SymmetricHash for a hash that does.
+    """
+
+    def __init__(self, game):
+        """Initializes the key from the game's current position"""
+        self._keys, self._black = zobrist_keys()
+        self._key = position_key(game)
+
+    def key(self):
+        """Returns the current key"""
+        return self._key
+
+    def move(self, name, source, destination, captured_name=None):
+        """Updates the key for the named piece moving between square indexes,
+        capturing the piece named captured_name if there is one. Calling it
+        again with the same arguments takes the move back."""
+        keys = self._keys[name]
+        self._key ^= keys[source] ^ keys[destination]
+        if captured_name is not None:
+            self._key ^= self._keys[captured_name][destination]
+
+    def toggle_side(self):
+        """Updates the key for the player to move changing"""
+        self._key ^= self._black
+
+    def to_canonical(self, move):
+        """Returns a move as it should be stored against the key"""
+        return move
+
+    def from_canonical(self, move):
+        """Returns a move stored against the key as a move in the current
+        position"""
+        return move
+
+
+class TranspositionTable:
+    """
+    Stores search results by Zobrist key. Each entry is a tuple of depth,
+    score, bound flag and best move. The oldest entries are dropped once the
+    table is full. Searches on several threads can share a table.
+    """
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+    def __init__(self, max_entries=1 << 20):
+        """Initializes an empty table holding up to max_entries positions"""
+        self._max_entries = max_entries
+        self._table = {}
+        # Taken to change the table. Reads need no lock, as a single dict
+        # lookup can't see the dict part way through a change.
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Returns the number of stored positions"""
+        return len(self._table)
+
+    def probe(self, key):
+        """Returns the entry for the key, or None if there isn't one"""
+        return self._table.get(key)
+
+    def store(self, key, depth, score, flag, move):
+        """Stores a search result. An existing entry for the same key is only
+        replaced by a search that was at least as deep."""
+        with self._lock:
+            entry = self._table.get(key)
+            if entry is not None:
+                if entry[0] > depth:
+                    return
+            elif len(self._table) >= self._max_entries:
+                # Dicts keep insertion order, so this drops the oldest entry
+                del self._table[next(iter(self._table))]
+            self._table[key] = (depth, score, flag, move)
+
+    def clear(self):
+        """Removes every entry"""
+        with self._lock:
+            self._table.clear()
+
+
+class Searcher:
+    """
+    Iterative deepening alpha-beta search over a copy of a XiangqiGame. Scores
+    are from the point of view of the player to move. A transposition table
+    and move orderer can be shared between searchers. Leaves are resolved by
+    a quiescence search over captures, which also tries checking moves for
+    the first quiescence_checks plies when that is above zero. Positions are
+    keyed by hash_type, which can be swapped for one that folds symmetric
+    positions together. Leaves are scored by material unless an evaluator
+    such as xiangqi_nnue.NNUEEvaluator is given, which is told of every move
+    made and taken back through its refresh, push and pop methods.
+    """
+
+    def __init__(self, tt=None, orderer=None, quiescence_checks=0,
+                 hash_type=None, evaluator=None):
+        """Initializes the searcher with its own transposition table and move
+        orderer unless they are given"""
+        if hash_type is None:
+            hash_type = ZobristHash
+        if tt is None:
+            tt = TranspositionTable()
+        if orderer is None:
+            orderer = MoveOrderer()
+        self._tt = tt
+        self._orderer = orderer
+        self._quiescence_checks = quiescence_checks
+        self._hash_type = hash_type
+        self._hash = None
+        self._evaluator = evaluator
+        self._nodes = 0
+        self._deadline = None
+        self._node_limit = None
+        self._stop_event = None
+        self._completed_depth = 0
+        self._have_result = False
+
+    def get_nodes(self):
+        """Returns the number of nodes visited by the last search"""
+        return self._nodes
+
+    def get_completed_depth(self):
+        """Returns the deepest iteration the last search finished"""
+        return self._completed_depth
+
+    def set_time_limit(self, time_ms):
+        """Sets the time the search may still run for in milliseconds, or no
+        limit for None. Can be called from another thread while the search is
+        running, e.g. to turn a ponder search into a timed one."""
+        if time_ms is None:
+            self._deadline = None
+        else:
+            self._deadline = time.monotonic() + time_ms / 1000
+
+    def set_node_limit(self, nodes):
+        """Sets the number of nodes a search may visit, or no limit for
+        None"""
+        self._node_limit = nodes
+
+    def evaluate(self, game):
+        """Returns the evaluator's score, or the material balance, from the
+        point of view of the player to move"""
+        if self._evaluator is not None:
+            return self._evaluator.evaluate(game._turn)
+        score = 0
+        for row in game.get_board():
+            for item in row:
+                if item != '--':
+                    if item.get_color() == game._turn:
+                        score += piece_value(item)
+                    else:
+                        score -= piece_value(item)
+        return score
+
+    def search(self, game, depth, time_ms=None, stop_event=None,
+               nodes=None):
+        """Searches the game's position to the given depth. Returns the best
+        move and its score, or (None, 0) if the game is over. The game passed
+        in is not modified. The search ends early once time_ms milliseconds
+        have passed, more than nodes nodes have been visited or stop_event (a
+        threading.Event) is set, returning the result of the last finished
+        iteration. The time and node limits don't apply until the first
+        iteration has finished, so there is always a move."""
+        if game.get_game_state() != "UNFINISHED":
+            return None, 0
+        game = copy.deepcopy(game)
+        self._start(game)
+        self._nodes = 0
+        self._completed_depth = 0
+        self._have_result = False
+        self._stop_event = stop_event
+        self.set_time_limit(time_ms)
+        self.set_node_limit(nodes)
+
+        best_move = None
+        best_score = 0
+        for current_depth in range(1, depth + 1):
+            try:
+                score = self._negamax(game, current_depth, -MATE_SCORE,
+                                      MATE_SCORE, 0)
+            except SearchStopped:
+                break
+            entry = self._tt.probe(self._hash.key())
+            if entry is not None and entry[3] is not None:
+                best_move = self._hash.from_canonical(entry[3])
+                best_score = score
+            self._completed_depth = current_depth
+            self._have_result = True
+        return best_move, best_score
+
+    def _check_stop(self):
+        """Raises SearchStopped if the search has been told to stop or is out
+        of time. The time and node limits are only checked once there is a
+        result to return."""
+        if self._stop_event is not None and self._stop_event.is_set():
+            raise SearchStopped()
+        if not self._have_result:
+            return
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            raise SearchStopped()
+        if self._node_limit is not None and self._nodes > self._node_limit:
+            raise SearchStopped()
+
+    def analyze(self, game, multipv=1, depth=MAX_PLY // 2, time_ms=None,
+                nodes=None, stop_event=None, callback=None):
+        """Searches for the multipv best moves in the game's position by
+        iterative deepening. Returns a list of (move, score, principal
+        variation) best first, from the deepest iteration that finished.
+        After each iteration callback, if given, is called with the depth and
+        the lines so far. Limits work as for search, except that the time and
+        node limits apply as soon as the first iteration has found its best
+        line. The game passed in is not modified.
+
+        The list has fewer than multipv lines when there are fewer legal
+        moves, or when the first iteration was stopped before every line was
+        searched. It then holds the lines that were, so under a time or node
+        limit it always has at least the best move. Once the first iteration
+        has finished, every line comes from one iteration."""
+        if game.get_game_state() != "UNFINISHED":
+            return []
+        game = copy.deepcopy(game)
+        self._start(game)
+        self._nodes = 0
+        self._completed_depth = 0
+        self._have_result = False
+        self._stop_event = stop_event
+        self.set_time_limit(time_ms)
+        self.set_node_limit(nodes)
+
+        lines = []
+        for current_depth in range(1, depth + 1):
+            # Each line is searched with the better lines' moves left out,
+            # trying the move it had in the last iteration first
+            new_lines = []
+            try:
+                for index in range(multipv):
+                    previous = lines[index][0] if index < len(lines) else None
+                    move, score = self._search_root(
+                        game, current_depth, previous,
+                        [line[0] for line in new_lines])
+                    if move is None:
+                        break
+                    new_lines.append((move, score, self._principal_variation(
+                        game, move, current_depth)))
+                    self._have_result = True
+            except SearchStopped:
+                if current_depth == 1:
+                    lines = sorted(new_lines, key=lambda line: -line[1])
+                break
+            lines = sorted(new_lines, key=lambda line: -line[1])
+            self._completed_depth = current_depth
+            if callback is not None:
+                callback(current_depth, lines)
+        return lines
+
+    def _search_root(self, game, depth, first_move, excluded):
+        """Searches the root position to depth, leaving out the excluded
+        moves. Returns the best move left and its score, or (None, 0) if
+        there is no legal move left."""
+        self._nodes += 1
+        alpha = -MATE_SCORE
+        best_score = -MATE_SCORE
+        best_move = None
+        for move in self._orderer.ordered_moves(game, 0, first_move):
+            if move in excluded:
+                continue
+            captured = self.make(game, move)
+            if captured is None:
+                continue
+            score = -self._negamax(game, depth - 1, -MATE_SCORE, -alpha, 1)
+            self.unmake(game, move, captured)
+            if score > best_score:
+                best_score = score
+                best_move = move
+                alpha = score
+        if best_move is None:
+            return None, 0
+        return best_move, best_score
+
+    def _principal_variation(self, game, move, depth):
+        """Returns the line starting with move, followed by the best moves
+        stored in the transposition table, up to depth moves"""
+        line = [move]
+        made = [(move, self.make(game, move))]
+        seen = {self._hash.key()}
+        while len(line) < depth:
+            entry = self._tt.probe(self._hash.key())
+            if entry is None or entry[3] is None:
+                break
+            reply = self._hash.from_canonical(entry[3])
+            if not self._orderer.is_pseudo_legal(game, reply):
+                break
+            captured = self.make(game, reply)
+            if captured is None:
+                break
+            made.append((reply, captured))
+            line.append(reply)
+            # A repeated position would make the line go round forever
+            if self._hash.key() in seen:
+                break
+            seen.add(self._hash.key())
+        for reply, captured in reversed(made):
+            self.unmake(game, reply, captured)
+        return line
+
+    def _start(self, game):
+        """Sets up the position keys and evaluator for a new search of the
+        game"""
+        self._hash = self._hash_type(game)
+        if self._evaluator is not None:
+            self._evaluator.refresh(game)
+
+    def make(self, game, move):
+        """Makes a move during search and passes the turn. Returns the
+        captured item ('--' for none), or None if the move would leave the
+        mover in check, in which case the board is left unchanged."""
+        source, destination = move
+        item = game.get_object_from_coord(source)
+        captured = game.move_piece(source, destination)
+        if game.check_for_check():
+            game.unmove_piece(source, destination, captured)
+            return None
+
+        captured_name = None if captured == '--' else captured.print_piece()
+        self._hash.move(item.print_piece(), SQUARE_INDEX[source],
+                        SQUARE_INDEX[destination], captured_name)
+        self._hash.toggle_side()
+        if self._evaluator is not None:
+            self._evaluator.push(item.print_piece(), SQUARE_INDEX[source],
+                                 SQUARE_INDEX[destination], captured_name)
+        game.change_turn()
+        return captured
+
+    def unmake(self, game, move, captured):
+        """Takes back a move made with make"""
+        source, destination = move
+        game.change_turn()
+        game.unmove_piece(source, destination, captured)
+
+        # Moving a piece is its own inverse for Zobrist keys
+        self._hash.move(game.get_object_from_coord(source).print_piece(),
+                        SQUARE_INDEX[source], SQUARE_INDEX[destination],
+                        None if captured == '--' else captured.print_piece())
+        self._hash.toggle_side()
+        if self._evaluator is not None:
+            self._evaluator.pop()
+
+    def _negamax(self, game, depth, alpha, beta, ply):
+        """Alpha-beta search returning the score of the position for the
+        player to move"""
+        if depth <= 0:
+            return self.quiesce(game, alpha, beta, ply,
+                                self._quiescence_checks)
+        self._nodes += 1
+        self._check_stop()
+
+        original_alpha = alpha
+        tt_move = None
+        entry = self._tt.probe(self._hash.key())
+        if entry is not None:
+            if entry[3] is not None:
+                tt_move = self._hash.from_canonical(entry[3])
+            if entry[0] >= depth:
+                tt_score = score_from_tt(entry[1], ply)
+                if entry[2] == TranspositionTable.EXACT:
+                    return tt_score
+                elif entry[2] == TranspositionTable.LOWER:
+                    alpha = max(alpha, tt_score)
+                elif entry[2] == TranspositionTable.UPPER:
+                    beta = min(beta, tt_score)
+                if alpha >= beta:
+                    return tt_score
+
+        best_score = -MATE_SCORE
+        best_move = None
+        legal_moves = 0
+        for move in self._orderer.ordered_moves(game, ply, tt_move):
+            captured = self.make(game, move)
+            if captured is None:
+                continue
+            legal_moves += 1
+            score = -self._negamax(game, depth - 1, -beta, -alpha, ply + 1)
+            self.unmake(game, move, captured)
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if captured == '--':
+                    self._orderer.add_killer(ply, move)
+                    self._orderer.add_history(move, depth)
+                break
+
+        # A player with no legal moves has lost
+        if legal_moves == 0:
+            return -MATE_SCORE + ply
+
+        if best_score <= original_alpha:
+            flag = TranspositionTable.UPPER
+        elif best_score >= beta:
+            flag = TranspositionTable.LOWER
+        else:
+            flag = TranspositionTable.EXACT
+        self._tt.store(self._hash.key(), depth, score_to_tt(best_score, ply),
+                       flag, self._hash.to_canonical(best_move))
+        return best_score
+
+    def quiesce(self, game, alpha, beta, ply, checks_left=0):
+        """Searches captures until the position is quiet so the score isn't
+        taken in the middle of an exchange. Captures that lose material by
+        SEE are skipped. While checks_left is above zero, quiet checking moves
+        are searched too and a player in check must find an evasion."""
+        self._nodes += 1
+        self._check_stop()
+        if ply >= MAX_PLY:
+            return self.evaluate(game)
+
+        # Check is only looked for when checks are being extended, otherwise
+        # this would cost a full check scan per node
+        if checks_left > 0 and game.check_for_check():
+            best_score = -MATE_SCORE + ply
+            for move in self._orderer.ordered_moves(game, ply):
+                captured = self.make(game, move)
+                if captured is None:
+                    continue
+                score = -self.quiesce(game, -beta, -alpha, ply + 1,
+                                      checks_left - 1)
+                self.unmake(game, move, captured)
+                if score > best_score:
+                    best_score = score
+                if score > alpha:
+                    alpha = score
+                if alpha >= beta:
+                    break
+            return best_score
+
+        # The player to move can stand pat instead of capturing
+        best_score = self.evaluate(game)
+        if best_score >= beta:
+            return best_score
+        if best_score > alpha:
+            alpha = best_score
+
+        for move in self._orderer.capture_moves(game):
+            if not is_safe_capture(game, move) and see(game, *move) < 0:
+                continue
+            captured = self.make(game, move)
+            if captured is None:
+                continue
+            score = -self.quiesce(game, -beta, -alpha, ply + 1,
+                                  checks_left - 1)
+            self.unmake(game, move, captured)
+            if score > best_score:
+                best_score = score
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                return best_score
+
+        if checks_left > 0:
+            for item in side_pieces(game, game._turn):
+                source = item.get_coordinate()
+                for destination in game.legality_check(item):
+                    if game.get_object_from_coord(destination) != '--':
+                        continue
+                    move = (source, destination)
+                    captured = self.make(game, move)
+                    if captured is None:
+                        continue
+                    # After make the opponent is to move, so this asks
+                    # whether the move gave check
+                    if game.check_for_check():
+                        score = -self.quiesce(game, -beta, -alpha, ply + 1,
+                                              checks_left - 1)
+                    else:
+                        score = best_score
+                    self.unmake(game, move, captured)
+                    if score > best_score:
+                        best_score = score
+                    if score > alpha:
+                        alpha = score
+                    if alpha >= beta:
+                        return best_score
+
+        return best_score
+
+
+def score_to_tt(score, ply):
+    """Converts a mate score to be relative to the stored position instead of
+    the root"""
+    if score > MATE_SCORE - MAX_PLY * 2:
+        return score + ply
+    if score < -MATE_SCORE + MAX_PLY * 2:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    """Converts a stored mate score back to be relative to the root"""
+    if score > MATE_SCORE - MAX_PLY * 2:
+        return score - ply
+    if score < -MATE_SCORE + MAX_PLY * 2:
+        return score + ply
+    return score
+
+
+# Transposition tables kept per game for analyze, so calls on the same game
+# build on each other. Weak keys let a table go with its game.
+_analysis_tables = weakref.WeakKeyDictionary()
+_analysis_lock = threading.Lock()
+
+
+def analyze(game, multipv=1, time_ms=None, nodes=None, depth=None,
+            stop_event=None, callback=None):
+    """Returns the multipv best lines in the game's position as a list of
+    (move, score, principal variation), as Searcher.analyze, which may hold
+    fewer lines if the limits ran out during the first iteration. Calls on
+    the same game share a transposition table and may run on several threads
+    at once, each with its own searcher. Without a time or node limit the
+    depth defaults to 4."""
+    if depth is None:
+        depth = 4 if time_ms is None and nodes is None else MAX_PLY // 2
+    with _analysis_lock:
+        tt = _analysis_tables.get(game)
+        if tt is None:
+            tt = TranspositionTable()
+            _analysis_tables[game] = tt
+    return Searcher(tt).analyze(game, multipv, depth, time_ms, nodes,
+                                stop_event, callback)
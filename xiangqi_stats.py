@@ -0,0 +1,297 @@
+# Description: Win/draw/loss statistics per position over large archives of
+# games in the game file format written by xiangqi_tournament. Games are
+# streamed and replayed without legality checks, counters are kept per
+# position key in a bounded map that spills sorted runs to disk, shards are
+# counted in separate processes and the runs are merged into one sorted file
+# that can be queried by FEN or by move prefix.
+
+import argparse
+import concurrent.futures
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+
+from XiangqiGame import XiangqiGame
+from xiangqi_search import ZobristHash, SQUARE_INDEX, position_key
+from xiangqi_tournament import parse_move
+
+
+# Records are a position key followed by red wins, draws and black wins
+RECORD = struct.Struct('<QIII')
+HEADER = struct.Struct('<4sIQ')
+MAGIC = b'XQST'
+VERSION = 1
+
+# Index into a record's counts for each result code in the game file
+RESULT_INDEXES = {
+    '1-0': 0,
+    '1/2': 1,
+    '0-1': 2
+}
+
+
+def read_games(path, start=0, end=None):
+    """Generator of (result index, moves) for the games in a game file whose
+    lines begin at a byte offset from start up to end. Lines that aren't
+    games are skipped."""
+    with open(path, 'rb') as games:
+        if start > 0:
+            # Back up one byte so a shard starting exactly on a line keeps it
+            games.seek(start - 1)
+            games.readline()
+        while end is None or games.tell() < end:
+            line = games.readline()
+            if not line:
+                break
+            fields = line.decode().split()
+            if len(fields) < 4 or fields[0] not in RESULT_INDEXES:
+                continue
+            yield (RESULT_INDEXES[fields[0]],
+                   [parse_move(text) for text in fields[4:]])
+
+
+def position_keys(moves, max_plies=None):
+    """Generator of the position key before the first move and after each
+    move, up to max_plies moves. The moves are trusted, so they are played
+    with move_piece and the key is updated incrementally with no check or
+    game state work."""
+    game = XiangqiGame()
+    zobrist = ZobristHash(game)
+    yield zobrist.key()
+    for ply, (source, destination) in enumerate(moves):
+        if max_plies is not None and ply >= max_plies:
+            break
+        name = game.get_object_from_coord(source).print_piece()
+        captured = game.move_piece(source, destination)
+        zobrist.move(name, SQUARE_INDEX[source], SQUARE_INDEX[destination],
+                     None if captured == '--' else captured.print_piece())
+        zobrist.toggle_side()
+        game.change_turn()
+        yield zobrist.key()
+
+
+class PositionCounter:
+    """
+    Result counters per position key. Once max_entries positions are held,
+    the counters are written to disk as a run sorted by key and the map
+    starts again, so memory stays bounded however many games are counted.
+    """
+
+    def __init__(self, max_entries=1 << 20, spill_dir=None):
+        """Initializes an empty counter map. Runs go to spill_dir, or the
+        system temporary directory."""
+        self._max_entries = max_entries
+        self._spill_dir = spill_dir
+        self._counts = {}
+        self._runs = []
+
+    def add(self, key, result_index):
+        """Counts one game result for the position key"""
+        counts = self._counts.get(key)
+        if counts is None:
+            if len(self._counts) >= self._max_entries:
+                self.spill()
+            counts = [0, 0, 0]
+            self._counts[key] = counts
+        counts[result_index] += 1
+
+    def spill(self):
+        """Writes the counters held in memory to a new sorted run"""
+        if not self._counts:
+            return
+        handle, path = tempfile.mkstemp(suffix='.run', dir=self._spill_dir)
+        with os.fdopen(handle, 'wb') as run:
+            for key in sorted(self._counts):
+                counts = self._counts[key]
+                run.write(RECORD.pack(key, counts[0], counts[1], counts[2]))
+        self._counts = {}
+        self._runs.append(path)
+
+    def finish(self):
+        """Spills whatever is left and returns the paths of every run"""
+        self.spill()
+        return self._runs
+
+
+def count_games(path, start=0, end=None, max_plies=40, max_entries=1 << 20,
+                spill_dir=None):
+    """Counts results per position for the games in one shard of a game
+    file. Each position is counted once per game even if it repeats.
+    Returns the paths of the sorted runs written."""
+    counter = PositionCounter(max_entries, spill_dir)
+    for result_index, moves in read_games(path, start, end):
+        for key in set(position_keys(moves, max_plies)):
+            counter.add(key, result_index)
+    return counter.finish()
+
+
+def _read_run(path):
+    """Generator of the records in a run file"""
+    with open(path, 'rb') as run:
+        while True:
+            chunk = run.read(RECORD.size * 4096)
+            if not chunk:
+                break
+            for record in RECORD.iter_unpack(chunk):
+                yield record
+
+
+def merge_runs(run_paths, output_path):
+    """Merges sorted runs into one sorted statistics file, adding up the
+    counters of keys found in several runs. Returns the number of positions
+    written."""
+    positions = 0
+    with open(output_path, 'wb') as output:
+        output.write(HEADER.pack(MAGIC, VERSION, 0))
+        current = None
+        for record in heapq.merge(*[_read_run(path) for path in run_paths]):
+            if current is not None and current[0] == record[0]:
+                current = (current[0], current[1] + record[1],
+                           current[2] + record[2], current[3] + record[3])
+                continue
+            if current is not None:
+                output.write(RECORD.pack(*current))
+                positions += 1
+            current = record
+        if current is not None:
+            output.write(RECORD.pack(*current))
+            positions += 1
+        output.seek(0)
+        output.write(HEADER.pack(MAGIC, VERSION, positions))
+    return positions
+
+
+def _shards(paths, shard_bytes):
+    """Splits the game files into byte ranges of about shard_bytes each"""
+    shards = []
+    for path in paths:
+        size = os.path.getsize(path)
+        start = 0
+        while start < size:
+            shards.append((path, start, min(start + shard_bytes, size)))
+            start += shard_bytes
+    return shards
+
+
+def aggregate(paths, output_path, workers=None, max_plies=40,
+              max_entries=1 << 20, spill_dir=None, shard_bytes=1 << 26):
+    """Counts results per position over every game in the game files, in
+    shards spread over a process pool, then merges the shards' runs into the
+    statistics file at output_path. Positions after max_plies moves are not
+    counted. Each worker holds at most max_entries counters. Returns the
+    number of positions written."""
+    runs = []
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(count_games, path, start, end, max_plies,
+                               max_entries, spill_dir)
+                   for path, start, end in _shards(paths, shard_bytes)]
+        for future in futures:
+            runs.extend(future.result())
+    try:
+        return merge_runs(runs, output_path)
+    finally:
+        for path in runs:
+            os.remove(path)
+
+
+class OpeningStats:
+    """
+    Read access to a statistics file written by aggregate. The file is
+    memory mapped and searched by key, so opening it costs nothing however
+    large it is.
+    """
+
+    def __init__(self, path):
+        """Opens the statistics file. Raises ValueError if it isn't one."""
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, positions = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('Not a statistics file: ' + path)
+        self._positions = positions
+
+    def __len__(self):
+        """Returns the number of positions in the file"""
+        return self._positions
+
+    def close(self):
+        """Closes the file"""
+        self._map.close()
+        self._file.close()
+
+    def lookup_key(self, key):
+        """Returns the (red wins, draws, black wins) counts for a position
+        key, or None if the position was never reached"""
+        low = 0
+        high = self._positions
+        while low < high:
+            middle = (low + high) // 2
+            record = RECORD.unpack_from(self._map,
+                                        HEADER.size + middle * RECORD.size)
+            if record[0] < key:
+                low = middle + 1
+            elif record[0] > key:
+                high = middle
+            else:
+                return record[1:]
+        return None
+
+    def lookup_fen(self, fen):
+        """Returns the counts for the position given as a FEN string"""
+        game = XiangqiGame()
+        game.set_fen(fen)
+        return self.lookup_key(position_key(game))
+
+    def lookup_moves(self, moves):
+        """Returns the counts for the position reached by playing the moves
+        from the start. Moves are (source, destination) pairs or compact
+        strings such as h3e3."""
+        moves = [parse_move(move) if isinstance(move, str) else move
+                 for move in moves]
+        key = None
+        for key in position_keys(moves):
+            pass
+        return self.lookup_key(key)
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(
+        description='Build or query position statistics over game files.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('aggregate')
+    build.add_argument('output')
+    build.add_argument('games', nargs='+')
+    build.add_argument('--workers', type=int)
+    build.add_argument('--max-plies', type=int, default=40)
+    build.add_argument('--max-entries', type=int, default=1 << 20)
+    build.add_argument('--spill-dir')
+    query = commands.add_parser('query')
+    query.add_argument('stats')
+    query.add_argument('--fen')
+    query.add_argument('moves', nargs='*')
+    args = parser.parse_args()
+
+    if args.command == 'aggregate':
+        positions = aggregate(args.games, args.output, args.workers,
+                              args.max_plies, args.max_entries,
+                              args.spill_dir)
+        print('Positions:', positions)
+    else:
+        stats = OpeningStats(args.stats)
+        if args.fen:
+            counts = stats.lookup_fen(args.fen)
+        else:
+            counts = stats.lookup_moves(args.moves)
+        stats.close()
+        if counts is None:
+            print('Position not found')
+        else:
+            print('Red wins: %d, draws: %d, black wins: %d' % counts)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# Description: Symmetry canonicalization for Xiangqi positions. The board is
+# left-right symmetric, and flipping it top to bottom while swapping the colors
+# and the player to move gives an equivalent position. Caches, opening books
+# and tables keyed by the canonical key share one entry between all four
+# images of a position, with moves stored in the canonical orientation.
+
+from xiangqi_search import zobrist_keys, SQUARES, SQUARE_INDEX, PIECE_NAMES
+
+
+# The four symmetries. Every one of them is its own inverse.
+IDENTITY = 0
+MIRROR = 1
+FLIP = 2
+MIRROR_FLIP = 3
+TRANSFORMS = [IDENTITY, MIRROR, FLIP, MIRROR_FLIP]
+
+
+def transform_square(transform, index):
+    """Returns the square index that index maps to under the transform"""
+    row, column = divmod(index, 9)
+    if transform == MIRROR or transform == MIRROR_FLIP:
+        column = 8 - column
+    if transform == FLIP or transform == MIRROR_FLIP:
+        row = 9 - row
+    return row * 9 + column
+
+
+def transform_coord(transform, coord):
+    """Returns the coordinate string that coord maps to under the transform"""
+    return SQUARES[transform_square(transform, SQUARE_INDEX[coord])]
+
+
+def transform_name(transform, name):
+    """Returns the piece name a piece takes under the transform. Flips swap
+    the colors."""
+    if transform == FLIP or transform == MIRROR_FLIP:
+        return ('b' if name[0] == 'r' else 'r') + name[1]
+    return name
+
+
+def transform_move(transform, move):
+    """Returns a (source, destination) move mapped by the transform. None is
+    passed through so empty best moves can be stored."""
+    if move is None or transform == IDENTITY:
+        return move
+    return (transform_coord(transform, move[0]),
+            transform_coord(transform, move[1]))
+
+
+_transformed_keys = None
+
+
+def transformed_keys():
+    """Returns the Zobrist keys as seen through each transform, in TRANSFORMS
+    order, so the key of the transformed position can be updated with the
+    original position's moves. Built on the first call."""
+    global _transformed_keys
+    if _transformed_keys is None:
+        keys = zobrist_keys()[0]
+        _transformed_keys = [
+            {name: [keys[transform_name(transform, name)][
+                transform_square(transform, index)] for index in range(90)]
+             for name in PIECE_NAMES}
+            for transform in TRANSFORMS]
+    return _transformed_keys
+
+
+def symmetric_keys(game):
+    """Returns the Zobrist keys of the game's position under each of the four
+    transforms, in TRANSFORMS order"""
+    tables = transformed_keys()
+    keys = [0, 0, 0, 0]
+    index = 0
+    for row in game.get_board():
+        for item in row:
+            if item != '--':
+                name = item.print_piece()
+                for transform in TRANSFORMS:
+                    keys[transform] ^= tables[transform][name][index]
+            index += 1
+
+    # The flipped images have the other player to move
+    black = zobrist_keys()[1]
+    black_to_move = game._turn == 'b'
+    for transform in TRANSFORMS:
+        flipped = transform == FLIP or transform == MIRROR_FLIP
+        if black_to_move != flipped:
+            keys[transform] ^= black
+    return keys
+
+
+def canonical_key(game):
+    """Returns the canonical key of the game's position and the transform that
+    maps the position onto its canonical image. Moves found in a table keyed
+    by the canonical key are mapped back with transform_move and the same
+    transform."""
+    keys = symmetric_keys(game)
+    key = min(keys)
+    return key, keys.index(key)
+
+
+class SymmetricHash:
+    """
+    Canonical key of a position kept up to date as moves are made and taken
+    back. All four transformed keys are updated incrementally, so the
+    canonical key costs a min over four integers. Has the same interface as
+    xiangqi_search.ZobristHash so it can be given to Searcher as hash_type.
+    """
+
+    def __init__(self, game):
+        """Initializes the four keys from the game's current position"""
+        self._tables = transformed_keys()
+        self._black = zobrist_keys()[1]
+        self._keys = symmetric_keys(game)
+
+    def key(self):
+        """Returns the canonical key"""
+        return min(self._keys)
+
+    def transform(self):
+        """Returns the transform mapping the position onto its canonical
+        image"""
+        return self._keys.index(min(self._keys))
+
+    def move(self, name, source, destination, captured_name=None):
+        """Updates the keys for the named piece moving between square indexes,
+        capturing the piece named captured_name if there is one. Calling it
+        again with the same arguments takes the move back."""
+        keys = self._keys
+        for transform in TRANSFORMS:
+            table = self._tables[transform]
+            keys[transform] ^= table[name][source] ^ table[name][destination]
+            if captured_name is not None:
+                keys[transform] ^= table[captured_name][destination]
+
+    def toggle_side(self):
+        """Updates the keys for the player to move changing"""
+        for transform in TRANSFORMS:
+            self._keys[transform] ^= self._black
+
+    def to_canonical(self, move):
+        """Returns a move in the current position as it should be stored
+        against the canonical key"""
+        return transform_move(self.transform(), move)
+
+    def from_canonical(self, move):
+        """Returns a move stored against the canonical key as a move in the
+        current position"""
+        return transform_move(self.transform(), move)
@@ -0,0 +1,324 @@
+# Description: Precomputed rule tables for XiangqiGame: where each piece can
+# go from each square on an empty board, the horse leg and elephant eye
+# squares that can block it, rook and cannon rays and the Zobrist keys. The
+# tables are generated once into a binary file and memory mapped on first
+# use, so every process shares the same pages instead of building its
+# own copy.
+
+import array
+import mmap
+import os
+import struct
+import sys
+
+
+# File header: magic, layout version, checksum of the generator and number of
+# tables, followed by an entry per table with its name, array type code, byte
+# offset and item count
+HEADER = struct.Struct('<4sIII')
+ENTRY = struct.Struct('<16sc3xII')
+MAGIC = b'XQRT'
+VERSION = 3
+
+# Default file, which can be moved with the XIANGQI_TABLES environment
+# variable, e.g. to a directory every worker can read
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'xiangqi_tables.bin')
+
+# Order of the pieces in the zobrist table, each with 90 keys, followed by
+# the key for black to move
+PIECE_NAMES = ['rG', 'rA', 'rE', 'rH', 'rR', 'rC', 'rS',
+               'bG', 'bA', 'bE', 'bH', 'bR', 'bC', 'bS']
+
+# Tables indexed by color are laid out red then black
+COLOR_INDEXES = {'r': 0, 'b': 1}
+
+# Ray directions in the order they are stored for each square
+RAY_STEPS = ((0, 1), (0, -1), (-1, 0), (1, 0))
+
+# Seed of the Zobrist keys, so keys are identical whoever generated the file
+ZOBRIST_SEED = 20200303
+
+
+def _on_board(row, column):
+    """Returns True if the row and column are on the board"""
+    return 0 <= row < 10 and 0 <= column < 9
+
+
+def _in_palace(color, row, column):
+    """Returns True if the square is inside color's palace"""
+    top_row = 7 if color == 'r' else 0
+    return top_row <= row <= top_row + 2 and 3 <= column <= 5
+
+
+def _grouped(lists, typecode):
+    """Flattens one list per group into (starts, items) arrays, where group
+    i's items are items[starts[i]:starts[i + 1]]"""
+    starts = array.array('H', [0])
+    items = array.array(typecode)
+    for group in lists:
+        items.extend(group)
+        starts.append(len(items))
+    return starts, items
+
+
+_checksum = None
+
+
+def generator_checksum():
+    """Returns the CRC-32 of this module's file, which is stored in the table
+    file's header. Any change to the tables, the Zobrist seed or the layout
+    changes it, so a file made by an older generator is regenerated without
+    anyone having to remember to bump VERSION."""
+    global _checksum
+    if _checksum is None:
+        # Only needed when a file is loaded or generated
+        import zlib
+
+        try:
+            with open(__file__, 'rb') as source:
+                _checksum = zlib.crc32(source.read())
+        except OSError:
+            _checksum = 0
+    return _checksum
+
+
+def generate_tables():
+    """Returns every table as a dict of name to array.array"""
+    # Only needed when the file is generated, so not imported at start up
+    import random
+
+    tables = {}
+
+    # Zobrist keys, drawn in the same order as they always have been so
+    # stored keys stay valid
+    generator = random.Random(ZOBRIST_SEED)
+    zobrist = array.array('Q')
+    for _ in PIECE_NAMES:
+        zobrist.extend(generator.getrandbits(64) for _ in range(90))
+    zobrist.append(generator.getrandbits(64))
+    tables['zobrist'] = zobrist
+
+    # The squares along each direction from each square, nearest first
+    rays = []
+    for square in range(90):
+        row, column = divmod(square, 9)
+        for row_step, column_step in RAY_STEPS:
+            ray = []
+            r = row + row_step
+            c = column + column_step
+            while _on_board(r, c):
+                ray.append(r * 9 + c)
+                r += row_step
+                c += column_step
+            rays.append(ray)
+    tables['ray_start'], tables['rays'] = _grouped(rays, 'B')
+
+    # Horse moves as (leg, destination) pairs, the leg being the square next
+    # to the horse that blocks the move
+    horse_legs = (((-1, 0), ((-2, -1), (-2, 1))),
+                  ((1, 0), ((2, -1), (2, 1))),
+                  ((0, -1), ((-1, -2), (1, -2))),
+                  ((0, 1), ((-1, 2), (1, 2))))
+    horses = []
+    for square in range(90):
+        row, column = divmod(square, 9)
+        pairs = []
+        for leg, destinations in horse_legs:
+            for row_step, column_step in destinations:
+                if _on_board(row + row_step, column + column_step):
+                    pairs += [(row + leg[0]) * 9 + column + leg[1],
+                              (row + row_step) * 9 + column + column_step]
+        horses.append(pairs)
+    tables['horse_start'], tables['horse'] = _grouped(horses, 'B')
+
+    # Elephant moves as (eye, destination) pairs. An elephant on the river
+    # bank at column c or g can't step across the river.
+    elephants = []
+    for square in range(90):
+        row, column = divmod(square, 9)
+        pairs = []
+        for row_step, column_step in ((-1, -1), (-1, 1), (1, -1), (1, 1)):
+            if not _on_board(row + 2 * row_step, column + 2 * column_step):
+                continue
+            if row == 5 and (column == 2 or column == 6) and row_step < 0:
+                continue
+            if row == 4 and (column == 2 or column == 6) and row_step > 0:
+                continue
+            pairs += [(row + row_step) * 9 + column + column_step,
+                      (row + 2 * row_step) * 9 + column + 2 * column_step]
+        elephants.append(pairs)
+    tables['elephant_start'], tables['elephant'] = _grouped(elephants, 'B')
+
+    # Moves that depend on the color's palace or side of the river. Advisors
+    # only have moves from the palace's diagonal points.
+    advisors = []
+    generals = []
+    soldiers = []
+    for color in ('r', 'b'):
+        top_row = 7 if color == 'r' else 0
+        forward = -1 if color == 'r' else 1
+        for square in range(90):
+            row, column = divmod(square, 9)
+            crossed = row <= 4 if color == 'r' else row >= 5
+
+            advisor = []
+            general = []
+            if _in_palace(color, row, column):
+                if (row + column) % 2 == (top_row + 1 + 4) % 2:
+                    for row_step, column_step in ((-1, -1), (-1, 1), (1, -1),
+                                                  (1, 1)):
+                        if _in_palace(color, row + row_step,
+                                      column + column_step):
+                            advisor.append((row + row_step) * 9 + column +
+                                           column_step)
+                for row_step, column_step in ((-1, 0), (1, 0), (0, -1),
+                                              (0, 1)):
+                    if _in_palace(color, row + row_step,
+                                  column + column_step):
+                        general.append((row + row_step) * 9 + column +
+                                       column_step)
+            advisors.append(advisor)
+            generals.append(general)
+
+            soldier = []
+            if _on_board(row + forward, column):
+                soldier.append(square + forward * 9)
+            if crossed:
+                if column > 0:
+                    soldier.append(square - 1)
+                if column < 8:
+                    soldier.append(square + 1)
+            soldiers.append(soldier)
+    tables['advisor_start'], tables['advisor'] = _grouped(advisors, 'B')
+    tables['general_start'], tables['general'] = _grouped(generals, 'B')
+    tables['soldier_start'], tables['soldier'] = _grouped(soldiers, 'B')
+    return tables
+
+
+def encode_tables():
+    """Returns the contents of a table file"""
+    tables = generate_tables()
+    offset = HEADER.size + ENTRY.size * len(tables)
+    entries = []
+    data = []
+    for name, table in tables.items():
+        # Tables start on 8 byte boundaries so they can be cast in place
+        padding = -offset % 8
+        data.append(bytes(padding))
+        offset += padding
+        entries.append(ENTRY.pack(name.encode(), table.typecode.encode(),
+                                  offset, len(table)))
+        data.append(table.tobytes())
+        offset += len(data[-1])
+    return (HEADER.pack(MAGIC, VERSION, generator_checksum(), len(tables)) +
+            b''.join(entries) + b''.join(data))
+
+
+def write_tables(path):
+    """Writes a table file to path. The file is written under another name
+    and moved into place, so a process loading it never sees half a
+    file."""
+    import tempfile
+
+    contents = encode_tables()
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as output:
+            output.write(contents)
+        # mkstemp makes the file private, but every process should read it
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+class RuleTables:
+    """
+    Read access to the tables in a buffer holding a table file. Each table
+    is an attribute of the same name, a memoryview that indexes like a list
+    of ints. Moves from a square are looked up with the square's start and
+    the next one, e.g. rays[ray_start[square * 4 + direction]:
+    ray_start[square * 4 + direction + 1]].
+    """
+
+    def __init__(self, buffer):
+        """Reads the table directory from the buffer. Raises ValueError if it
+        isn't a table file made by this version of the generator."""
+        if len(buffer) < HEADER.size:
+            raise ValueError('Not a rule table file')
+        magic, version, checksum, count = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a rule table file of version %d' % VERSION)
+        if checksum != generator_checksum():
+            raise ValueError('Rule table file is from another generator')
+        if sys.byteorder != 'little':
+            raise ValueError('Rule table files are little endian and need a '
+                             'little endian machine')
+        self._buffer = buffer
+        view = memoryview(buffer)
+        for index in range(count):
+            name, typecode, offset, length = ENTRY.unpack_from(
+                buffer, HEADER.size + index * ENTRY.size)
+            typecode = typecode.decode()
+            size = array.array(typecode).itemsize
+            if offset + length * size > len(buffer):
+                raise ValueError('Rule table file is truncated')
+            setattr(self, name.rstrip(b'\0').decode(),
+                    view[offset:offset + length * size].cast(typecode))
+
+    def __deepcopy__(self, memo):
+        """The tables are read only, so copies of games share them"""
+        return self
+
+    def __reduce__(self):
+        """Pickles as a reference to the receiving process's own tables"""
+        return get_tables, ()
+
+    def zobrist_keys(self, name):
+        """Returns the 90 Zobrist keys of a piece name such as 'rH'"""
+        start = PIECE_NAMES.index(name) * 90
+        return self.zobrist[start:start + 90]
+
+    def zobrist_black(self):
+        """Returns the Zobrist key for black to move"""
+        return self.zobrist[len(PIECE_NAMES) * 90]
+
+
+def load_tables(path):
+    """Returns the RuleTables of a table file, memory mapped read only"""
+    with open(path, 'rb') as tables:
+        buffer = mmap.mmap(tables.fileno(), 0, access=mmap.ACCESS_READ)
+    return RuleTables(buffer)
+
+
+_tables = None
+
+
+def get_tables():
+    """Returns the process's RuleTables, loading them on the first call. The
+    table file is generated if it is missing or from another generator. If it
+    can't be written, the tables are built in memory instead."""
+    global _tables
+    if _tables is not None:
+        return _tables
+    path = os.environ.get('XIANGQI_TABLES', DEFAULT_PATH)
+    try:
+        _tables = load_tables(path)
+        return _tables
+    except (OSError, ValueError):
+        pass
+    try:
+        write_tables(path)
+        _tables = load_tables(path)
+    except OSError:
+        _tables = RuleTables(encode_tables())
+    return _tables
+
+
+if __name__ == '__main__':
+    # Generates the table file ahead of time, e.g. when deploying
+    write_tables(sys.argv[1] if len(sys.argv) > 1 else
+                 os.environ.get('XIANGQI_TABLES', DEFAULT_PATH))
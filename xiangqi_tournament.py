@@ -0,0 +1,352 @@
+# Description: Self-play tournament runner for engines built on XiangqiGame.
+# Games between two engine configurations are played across a process pool,
+# written to a game file as they finish and tested with an SPRT so the run can
+# stop as soon as there is a verdict.
+
+import argparse
+import concurrent.futures
+import math
+import os
+import random
+import re
+
+from XiangqiGame import XiangqiGame
+from xiangqi_search import Searcher, side_pieces
+
+
+# A small default opening suite. Each opening is a list of moves played from
+# the starting position before the engines take over.
+DEFAULT_OPENINGS = [
+    [],
+    [('h3', 'e3')],
+    [('b3', 'e3')],
+    [('h3', 'e3'), ('h10', 'g8')],
+    [('h3', 'e3'), ('b8', 'e8')],
+    [('c1', 'e3')],
+    [('g4', 'g5')],
+    [('c4', 'c5')],
+    [('h1', 'g3')],
+    [('b3', 'd3')],
+]
+
+# Result codes written to the game file, from red's point of view
+RESULT_CODES = {
+    'RED_WON': '1-0',
+    'BLACK_WON': '0-1',
+    'UNFINISHED': '1/2'
+}
+
+_MOVE_PATTERN = re.compile(r'([a-i])(10|[1-9])([a-i])(10|[1-9])')
+
+
+def format_move(move):
+    """Returns the compact text of a move, e.g. ('h3', 'e3') becomes h3e3"""
+    return move[0] + move[1]
+
+
+def parse_move(text):
+    """Returns the (source, destination) pair for the compact text of a move"""
+    match = _MOVE_PATTERN.fullmatch(text)
+    if match is None:
+        raise ValueError('Not a move: ' + text)
+    return (match.group(1) + match.group(2), match.group(3) + match.group(4))
+
+
+def load_openings(path):
+    """Reads an opening suite, one opening per line written as compact moves
+    separated by spaces. Blank lines and lines starting with # are skipped."""
+    openings = []
+    with open(path) as suite:
+        for line in suite:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            openings.append([parse_move(text) for text in line.split()])
+    return openings
+
+
+def parse_engine(text):
+    """Parses an engine configuration written as name:key=value,key=value.
+    Recognized keys are depth and checks (quiescence check plies)."""
+    name, _, options = text.partition(':')
+    config = {'name': name, 'depth': 2, 'checks': 0}
+    if options:
+        for option in options.split(','):
+            key, _, value = option.partition('=')
+            if key not in ('depth', 'checks'):
+                raise ValueError('Unknown engine option: ' + key)
+            config[key] = int(value)
+    return config
+
+
+def extend_opening(opening, plies, rng):
+    """Returns the opening followed by plies random legal moves chosen with
+    rng, a random.Random, or None if the game ends before then"""
+    game = XiangqiGame()
+    for move in opening:
+        if not game.make_move(*move):
+            raise ValueError('Illegal opening move: ' + format_move(move))
+    extended = list(opening)
+    for _ in range(plies):
+        if game.get_game_state() != "UNFINISHED":
+            return None
+        moves = [(item.get_coordinate(), destination)
+                 for item in side_pieces(game, game._turn)
+                 for destination in game.legality_check(item)]
+        rng.shuffle(moves)
+        for move in moves:
+            if game.make_move(*move):
+                extended.append(move)
+                break
+    if game.get_game_state() != "UNFINISHED":
+        return None
+    return extended
+
+
+def play_game(red_config, black_config, opening, max_plies=200):
+    """Plays one game between two engine configurations after the opening
+    moves. Returns the final game state and the list of moves played. Games
+    still unfinished after max_plies are adjudicated as draws."""
+    game = XiangqiGame()
+    moves = []
+    for move in opening:
+        if not game.make_move(*move):
+            raise ValueError('Illegal opening move: ' + format_move(move))
+        moves.append(move)
+
+    searchers = {
+        'r': (Searcher(quiescence_checks=red_config['checks']),
+              red_config['depth']),
+        'b': (Searcher(quiescence_checks=black_config['checks']),
+              black_config['depth'])
+    }
+    while game.get_game_state() == "UNFINISHED" and len(moves) < max_plies:
+        searcher, depth = searchers[game._turn]
+        move, _ = searcher.search(game, depth)
+        if move is None or not game.make_move(*move):
+            break
+        moves.append(move)
+    return game.get_game_state(), moves
+
+
+def _play_task(task):
+    """Worker entry point for the process pool. Returns the task with the
+    game's result added so the parent can match it up."""
+    state, moves = play_game(task['red'], task['black'], task['opening'],
+                             task['max_plies'])
+    task = dict(task)
+    task['state'] = state
+    task['moves'] = moves
+    return task
+
+
+def expected_score(elo):
+    """Returns the expected score for a player with the given Elo advantage"""
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+class SPRT:
+    """
+    Sequential probability ratio test on game results between engine A and
+    engine B. H0 is that A is elo0 stronger, H1 that it is elo1 stronger. The
+    log-likelihood ratio uses the normal approximation over win/draw/loss
+    counts, so draws are handled without a draw model.
+    """
+
+    def __init__(self, elo0=0.0, elo1=5.0, alpha=0.05, beta=0.05):
+        """Initializes the test with no games played"""
+        self._score0 = expected_score(elo0)
+        self._score1 = expected_score(elo1)
+        self._lower = math.log(beta / (1 - alpha))
+        self._upper = math.log((1 - beta) / alpha)
+        self._wins = 0
+        self._draws = 0
+        self._losses = 0
+
+    def add_result(self, score):
+        """Adds one game's score for engine A, 1, 0.5 or 0"""
+        if score == 1:
+            self._wins += 1
+        elif score == 0:
+            self._losses += 1
+        else:
+            self._draws += 1
+
+    def get_counts(self):
+        """Returns the win, draw and loss counts for engine A"""
+        return self._wins, self._draws, self._losses
+
+    def llr(self):
+        """Returns the log-likelihood ratio of H1 against H0"""
+        games = self._wins + self._draws + self._losses
+        if games == 0:
+            return 0.0
+        mean = (self._wins + 0.5 * self._draws) / games
+        variance = (self._wins * (1 - mean) ** 2 +
+                    self._draws * (0.5 - mean) ** 2 +
+                    self._losses * mean ** 2) / games
+        # With only one kind of result so far there is no variance to go on
+        if variance == 0:
+            return 0.0
+        return (games * (self._score1 - self._score0) *
+                (2 * mean - self._score0 - self._score1) / (2 * variance))
+
+    def get_bounds(self):
+        """Returns the lower and upper LLR bounds"""
+        return self._lower, self._upper
+
+    def verdict(self):
+        """Returns 'H1' if A is proven elo1 stronger, 'H0' if it is proven not
+        to be, or None while the test is still running"""
+        llr = self.llr()
+        if llr >= self._upper:
+            return 'H1'
+        if llr <= self._lower:
+            return 'H0'
+        return None
+
+
+def run_tournament(engine_a, engine_b, output_path, openings=None,
+                   max_games=1000, workers=None, max_plies=200, sprt=None,
+                   random_plies=4, seed=0):
+    """Plays engine A against engine B over the opening suite, each opening
+    twice with colors swapped, until max_games are played or the SPRT reaches
+    a verdict. Each finished game is appended to output_path as one line of
+    result, opening number, red engine, black engine and moves. Returns the
+    SPRT, which holds the counts and verdict.
+
+    The engines are deterministic, so replaying an opening would only repeat
+    earlier games and skew the SPRT. The first pass over the suite plays the
+    openings as they are. Each later pass extends every opening with
+    random_plies random legal moves, drawn from a generator seeded with seed,
+    and an extension is never reused. Both games of a color-swapped pair
+    get the same extended opening. With random_plies 0, or once no new
+    extension can be found, the run stops early."""
+    if openings is None:
+        openings = DEFAULT_OPENINGS
+    if sprt is None:
+        sprt = SPRT()
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    rng = random.Random(seed)
+    used = set()
+
+    def tasks():
+        game_number = 0
+        first_pass = True
+        while first_pass or random_plies > 0:
+            played = game_number
+            for opening_number, opening in enumerate(openings):
+                if not first_pass:
+                    # Tries a few times before giving up on an opening whose
+                    # extensions keep repeating or ending the game
+                    for _ in range(100):
+                        extended = extend_opening(opening, random_plies, rng)
+                        if (extended is not None and
+                                tuple(extended) not in used):
+                            break
+                    else:
+                        continue
+                    opening = extended
+                used.add(tuple(opening))
+                for a_is_red in (True, False):
+                    if game_number >= max_games:
+                        return
+                    yield {
+                        'game': game_number,
+                        'opening_number': opening_number,
+                        'opening': opening,
+                        'red': engine_a if a_is_red else engine_b,
+                        'black': engine_b if a_is_red else engine_a,
+                        'a_is_red': a_is_red,
+                        'max_plies': max_plies
+                    }
+                    game_number += 1
+            if game_number == played:
+                return
+            first_pass = False
+
+    pending_tasks = tasks()
+    with open(output_path, 'a') as output, \
+            concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        # Only a couple of games per worker are queued at a time, so little
+        # work is thrown away when the SPRT stops the run
+        in_flight = set()
+        for task in pending_tasks:
+            in_flight.add(pool.submit(_play_task, task))
+            if len(in_flight) >= 2 * workers:
+                break
+
+        while in_flight:
+            done, in_flight = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                output.write(' '.join(
+                    [RESULT_CODES[result['state']],
+                     str(result['opening_number']),
+                     result['red']['name'], result['black']['name']] +
+                    [format_move(move) for move in result['moves']]) + '\n')
+                output.flush()
+
+                if result['state'] == 'UNFINISHED':
+                    sprt.add_result(0.5)
+                elif (result['state'] == 'RED_WON') == result['a_is_red']:
+                    sprt.add_result(1)
+                else:
+                    sprt.add_result(0)
+
+            if sprt.verdict() is not None:
+                for future in in_flight:
+                    future.cancel()
+                break
+            for task in pending_tasks:
+                in_flight.add(pool.submit(_play_task, task))
+                if len(in_flight) >= 2 * workers:
+                    break
+    return sprt
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(
+        description='Play two engine configurations against each other.')
+    parser.add_argument('engine_a', help='e.g. new:depth=3,checks=1')
+    parser.add_argument('engine_b', help='e.g. base:depth=3')
+    parser.add_argument('--output', default='games.txt')
+    parser.add_argument('--openings', help='opening suite file')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--max-plies', type=int, default=200)
+    parser.add_argument('--elo0', type=float, default=0.0)
+    parser.add_argument('--elo1', type=float, default=5.0)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+    parser.add_argument('--random-plies', type=int, default=4,
+                        help='random moves added to openings after the first '
+                        'pass; 0 stops after the first pass')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    openings = None
+    if args.openings:
+        openings = load_openings(args.openings)
+    sprt = run_tournament(parse_engine(args.engine_a),
+                          parse_engine(args.engine_b), args.output, openings,
+                          args.games, args.workers, args.max_plies,
+                          SPRT(args.elo0, args.elo1, args.alpha, args.beta),
+                          args.random_plies, args.seed)
+    wins, draws, losses = sprt.get_counts()
+    games = wins + draws + losses
+    if sprt.verdict() is None and games < args.games:
+        print('Stopped after %d games: no opening is left that would not '
+              'repeat an earlier game' % games)
+    lower, upper = sprt.get_bounds()
+    print('W/D/L: %d/%d/%d' % (wins, draws, losses))
+    print('LLR: %.3f (%.3f, %.3f)' % (sprt.llr(), lower, upper))
+    print('Verdict:', sprt.verdict() or 'none')
+
+
+if __name__ == '__main__':
+    main()